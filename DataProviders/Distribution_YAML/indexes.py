@@ -0,0 +1,120 @@
+from bisect import bisect_left, bisect_right, insort
+from typing import Dict, Iterable, List, Optional, Sequence, Set, Tuple
+
+
+class SortedIndex:
+    """
+    Ascending ``(value, id)`` pairs for one field, so a range of values is
+    found by binary search instead of a scan.
+    """
+
+    def __init__(self):
+        self._pairs: List[Tuple[object, int]] = []
+
+    def add(self, value, record_id: int):
+        insort(self._pairs, (value, record_id))
+
+    def remove(self, value, record_id: int):
+        position = bisect_left(self._pairs, (value, record_id))
+        if position < len(self._pairs) and self._pairs[position] == (value, record_id):
+            del self._pairs[position]
+
+    def span(self, low=None, high=None) -> Tuple[int, int]:
+        start = 0 if low is None else bisect_left(self._pairs, low, key=lambda pair: pair[0])
+        stop = len(self._pairs) if high is None else bisect_right(self._pairs, high, key=lambda pair: pair[0])
+        return start, max(start, stop)
+
+    def ids(self, low=None, high=None) -> Iterable[int]:
+        start, stop = self.span(low, high)
+        return (record_id for _, record_id in self._pairs[start:stop])
+
+
+class RecordIndex:
+    """
+    Hash indexes on some fields and sorted indexes on others, over records
+    identified by an integer ID.
+
+    The mutation handlers ``put`` every record they store and ``remove``
+    every record they drop. ``query`` answers equality and range filters.
+    It starts from the smallest candidate set: the bucket or range with the
+    fewest IDs, which costs O(1) or O(log n) to size. It then checks only
+    those candidates against the remaining filters.
+    """
+
+    def __init__(self, hash_fields: Sequence[str], sorted_fields: Sequence[str]):
+        self._hashed: Dict[str, Dict[object, Set[int]]] = {field: {} for field in hash_fields}
+        self._sorted: Dict[str, SortedIndex] = {field: SortedIndex() for field in sorted_fields}
+        self._values: Dict[int, Dict[str, object]] = {}
+
+    def put(self, record_id: int, record):
+        """
+        Index a record, replacing what was indexed under its ID before.
+
+        Args:
+            record_id (int): The record's ID
+            record: The record; indexed fields are read as attributes
+        """
+        self.remove(record_id)
+        values = {field: getattr(record, field) for field in (*self._hashed, *self._sorted)}
+        self._values[record_id] = values
+        for field, index in self._hashed.items():
+            index.setdefault(values[field], set()).add(record_id)
+        for field, index in self._sorted.items():
+            index.add(values[field], record_id)
+
+    def remove(self, record_id: int):
+        """
+        Drop a record from every index.
+
+        Args:
+            record_id (int): The record's ID; unknown IDs are ignored
+        """
+        values = self._values.pop(record_id, None)
+        if values is None:
+            return
+        for field, index in self._sorted.items():
+            index.remove(values[field], record_id)
+        for field, index in self._hashed.items():
+            bucket = index.get(values[field])
+            if bucket is not None:
+                bucket.discard(record_id)
+                if not bucket:
+                    del index[values[field]]
+
+    def query(self, equals: Optional[Dict[str, object]] = None,
+              ranges: Optional[Dict[str, Tuple[object, object]]] = None) -> List[int]:
+        """
+        Find the records matching every filter.
+
+        Args:
+            equals (dict, optional): Hash-indexed fields mapped to the required value
+            ranges (dict, optional): Sorted fields mapped to inclusive ``(low, high)``
+                bounds, either of which may be None
+
+        Returns:
+            List[int]: The IDs of the matching records, in ascending order
+        """
+        equals = equals or {}
+        ranges = ranges or {}
+        candidates: Iterable[int] = self._values
+        size = len(self._values)
+        for field, value in equals.items():
+            bucket = self._hashed[field].get(value, ())
+            if len(bucket) < size:
+                candidates, size = bucket, len(bucket)
+        for field, (low, high) in ranges.items():
+            start, stop = self._sorted[field].span(low, high)
+            if stop - start < size:
+                candidates, size = self._sorted[field].ids(low, high), stop - start
+
+        def matches(record_id: int) -> bool:
+            values = self._values[record_id]
+            for field, value in equals.items():
+                if values[field] != value:
+                    return False
+            for field, (low, high) in ranges.items():
+                if (low is not None and values[field] < low) or (high is not None and values[field] > high):
+                    return False
+            return True
+
+        return sorted(record_id for record_id in candidates if matches(record_id))
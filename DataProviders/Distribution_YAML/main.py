@@ -1,10 +1,16 @@
-from fastapi import FastAPI, Request, HTTPException
+from fastapi import FastAPI, Header, Request, HTTPException
 from fastapi.responses import PlainTextResponse
-from pydantic import BaseModel, Field
-from typing import List, Dict
+from pydantic import BaseModel, Field, field_serializer, field_validator
+from typing import List, Dict, Optional
 from datetime import date
+import asyncio
+import os
 import yaml
 
+from indexes import RecordIndex
+from persistence import open_persistence
+from serialization import FragmentCache, decode, join_list, load, negotiate, render, respond
+
 class InventoryItem(BaseModel):
     item_id: int
     name: str
@@ -20,16 +26,88 @@ class Orders(BaseModel):
     status: str
     departure_date: date
     estimated_arrival: date
-    items: List[InventoryItem] = []
+    # Keyed by item_id for O(1) lookups; dicts keep insertion order, so the
+    # items still validate from and serialize to an ordered list.
+    items: Dict[int, InventoryItem] = {}
+
+    @field_validator("items", mode="before")
+    @classmethod
+    def index_items(cls, items):
+        if not isinstance(items, (list, tuple)):
+            raise ValueError("items must be a list")
+        index = {}
+        for item in items:
+            item = InventoryItem.model_validate(item)
+            if item.item_id in index:
+                raise ValueError(f"Duplicate item_id {item.item_id} in items")
+            index[item.item_id] = item
+        return index
+
+    @field_serializer("items")
+    def list_items(self, items: Dict[int, InventoryItem]) -> List[InventoryItem]:
+        return list(items.values())
 
 app = FastAPI()
 
 # In-memory order store
 orders: Dict[str, Orders] = {}
 
+# Hash indexes for exact matches and sorted indexes for date ranges, kept in
+# step with the store and used to filter GET /orders
+order_index = RecordIndex(hash_fields=("status", "origin", "destination"),
+                          sorted_fields=("departure_date", "estimated_arrival"))
+
+def store_order(order: Orders):
+    # Add or replace an order, keeping order_index in step.
+    orders[order.order_id] = order
+    order_index.put(order.order_id, order)
+
+def drop_order(order_id: int):
+    # Remove an order if present, keeping order_index in step.
+    orders.pop(order_id, None)
+    order_index.remove(order_id)
+
+# Upper bound on the number of ids in one multi-get request
+MAX_IDS = 1000
+
+DATA_FILE = os.path.join("data", "dc.yaml")
+JOURNAL_FILE = os.path.join("data", "dc.journal")
+
+# "journal" appends every mutation to JOURNAL_FILE and folds the journal into
+# DATA_FILE every COMPACT_INTERVAL seconds; "memory" never writes anything back.
+PERSISTENCE_MODE = os.environ.get("DISTRIBUTION_PERSISTENCE", "journal")
+COMPACT_INTERVAL = float(os.environ.get("DISTRIBUTION_COMPACT_INTERVAL", "60"))
+persistence = open_persistence(PERSISTENCE_MODE, DATA_FILE, JOURNAL_FILE, COMPACT_INTERVAL)
+
+# Serialized documents per order, reused until the order changes
+serialized = FragmentCache()
+
+def order_element(order_id: int) -> dict:
+    # An order as one element of the GET /orders list.
+    return orders[order_id].model_dump()
+
+def apply_entry(entry: dict):
+    # Replay one journal entry; see the mutation handlers for what they record.
+    op = entry["op"]
+    if op == "put":
+        store_order(Orders(**entry["record"]))
+    elif op == "delete":
+        drop_order(entry["id"])
+    elif entry["id"] in orders:
+        order = orders[entry["id"]]
+        if op == "put_item":
+            item = InventoryItem(**entry["item"])
+            order.items[item.item_id] = item
+        elif op == "delete_item":
+            order.items.pop(entry["item_id"], None)
+
+async def data_file_snapshot() -> bytes:
+    # The whole data file, assembled from the cached fragments of GET /orders.
+    return join_list("orders", await serialized.elements(list(orders), "yaml", order_element), "yaml")
+
 # Load orders from YAML file
-with open('data/dc.yaml', 'r') as file:
-    data = yaml.safe_load(file)
+with open(DATA_FILE, 'r') as file:
+    data = load(file)
     
     if not isinstance(data, dict) or 'orders' not in data or not isinstance(data['orders'], list):
         raise ValueError("Invalid order.yaml format. Expected 'orders' list at root level.")
@@ -43,37 +121,97 @@ with open('data/dc.yaml', 'r') as file:
                 
             # Create and store order object
             order = Orders(**order_data)
-            orders[order.order_id] = order
+            store_order(order)
         except ValueError as e:
             print(f"Error loading order: {e}")
 
+# Replay the changes made since the data file was last written
+for entry in persistence.load():
+    apply_entry(entry)
+persistence.start()
+
+@app.on_event("startup")
+async def start_compaction():
+    app.state.compaction = asyncio.create_task(persistence.run(data_file_snapshot))
+
+@app.on_event("shutdown")
+async def close_persistence():
+    compaction = getattr(app.state, "compaction", None)
+    if compaction is not None:
+        compaction.cancel()
+    await persistence.close(data_file_snapshot)
+
 @app.get("/orders", response_class=PlainTextResponse)
-async def get_orders():
+async def get_orders(ids: Optional[str] = None, status: Optional[str] = None,
+                     origin: Optional[str] = None, destination: Optional[str] = None,
+                     min_departure_date: Optional[date] = None, max_departure_date: Optional[date] = None,
+                     min_estimated_arrival: Optional[date] = None, max_estimated_arrival: Optional[date] = None,
+                     accept: Optional[str] = Header(None)):
     """
-    Retrieve a list of all orders in the system.
+    Retrieve a list of all orders in the system, or only the requested or matching ones.
+    
+    Args:
+        ids (str, optional): Comma-separated order IDs to look up in one request
+        status (str, optional): Only orders with this status
+        origin (str, optional): Only orders leaving this warehouse
+        destination (str, optional): Only orders bound for this warehouse
+        min_departure_date (date, optional): Only orders departing on or after this date
+        max_departure_date (date, optional): Only orders departing on or before this date
+        min_estimated_arrival (date, optional): Only orders arriving on or after this date
+        max_estimated_arrival (date, optional): Only orders arriving on or before this date
+        accept (str, optional): Accept header choosing YAML (default), JSON or MessagePack
     
     Returns:
-        PlainTextResponse: YAML formatted string containing all order information
+        Response: All order information in the negotiated format.
+            With filters, only the matching orders, by ascending order ID.
+            With ids, the orders found (in the order requested) and a
+            'missing' list of the IDs that do not exist
+    
+    Raises:
+        HTTPException: 400 if ids is combined with filters, is not a list of integers
+            or has more than MAX_IDS entries
     """
-    return yaml.dump({"orders": [w.model_dump() for w in orders.values()]}, sort_keys=False)
+    format = negotiate(accept)
+    equals = {field: value for field, value in
+              {"status": status, "origin": origin, "destination": destination}.items() if value is not None}
+    ranges = {field: bounds for field, bounds in
+              {"departure_date": (min_departure_date, max_departure_date),
+               "estimated_arrival": (min_estimated_arrival, max_estimated_arrival)}.items() if bounds != (None, None)}
+    if ids is not None:
+        if equals or ranges:
+            raise HTTPException(status_code=400, detail="ids cannot be combined with filters")
+        try:
+            requested = list(dict.fromkeys(int(i) for i in ids.split(",") if i.strip()))
+        except ValueError:
+            raise HTTPException(status_code=400, detail="ids must be a comma-separated list of integers")
+        if len(requested) > MAX_IDS:
+            raise HTTPException(status_code=400, detail=f"At most {MAX_IDS} ids can be requested at once")
+        found = await serialized.elements([i for i in requested if i in orders], format, order_element)
+        missing = [i for i in requested if i not in orders]
+        return respond(join_list("orders", found, format, {"missing": missing}), format)
+    matching = order_index.query(equals, ranges) if equals or ranges else list(orders)
+    elements = await serialized.elements(matching, format, order_element)
+    return respond(join_list("orders", elements, format), format)
 
 @app.get("/orders/{order_id}", response_class=PlainTextResponse)
-async def get_order(order_id: int):
+async def get_order(order_id: int, accept: Optional[str] = Header(None)):
     """
     Retrieve information about a specific order.
     
     Args:
         order_id (int): The unique identifier of the order
+        accept (str, optional): Accept header choosing YAML (default), JSON or MessagePack
     
     Returns:
-        PlainTextResponse: YAML formatted string containing the order information
+        Response: The order information in the negotiated format
     
     Raises:
         HTTPException: 404 if order is not found
     """
+    format = negotiate(accept)
     if order_id not in orders:
         raise HTTPException(status_code=404, detail="order not found")
-    return yaml.dump(orders[order_id].model_dump(), sort_keys=False)
+    return respond(await serialized.document(order_id, "document", format, lambda: orders[order_id].model_dump()), format)
 
 @app.post("/orders", response_class=PlainTextResponse)
 async def add_order(request: Request):
@@ -81,24 +219,27 @@ async def add_order(request: Request):
     Create a new order in the system.
     
     Args:
-        request (Request): FastAPI request object containing YAML formatted order data
+        request (Request): FastAPI request object with order data in the format named by its Content-Type
     
     Returns:
-        PlainTextResponse: YAML formatted string confirming order creation
+        Response: Confirmation of order creation in the negotiated format
     
     Raises:
-        HTTPException: 400 if YAML is invalid or order ID already exists
+        HTTPException: 400 if the body is invalid or order ID already exists
     """
+    format = negotiate(request.headers.get("accept"))
     body = await request.body()
     try:
-        data = yaml.safe_load(body)
+        data = decode(body, request.headers.get("content-type"))
         if data is None:
             raise HTTPException(status_code=400, detail="body must not be empty")
         order = Orders(**data)
         if order.order_id in orders:
             raise HTTPException(status_code=400, detail="order ID already exists")
-        orders[order.order_id] = order
-        return yaml.dump({"message": "order added", "order": order.model_dump()}, sort_keys=False)
+        store_order(order)
+        serialized.invalidate(order.order_id)
+        await persistence.commit([{"op": "put", "record": order.model_dump()}])
+        return render({"message": "order added", "order": order.model_dump()}, format)
     except yaml.YAMLError:
         raise HTTPException(status_code=400, detail="Invalid YAML format")
     except ValueError as e:
@@ -111,67 +252,76 @@ async def update_order(order_id: int, request: Request):
     
     Args:
         order_id (int): The unique identifier of the order to update
-        request (Request): FastAPI request object containing YAML formatted order data
+        request (Request): FastAPI request object with order data in the format named by its Content-Type
     
     Returns:
-        PlainTextResponse: YAML formatted string confirming order update
+        Response: Confirmation of order update in the negotiated format
     
     Raises:
-        HTTPException: 404 if order not found, 400 if YAML is invalid or IDs don't match
+        HTTPException: 404 if order not found, 400 if the body is invalid or IDs don't match
     """
-    if order_id not in orders:
-        raise HTTPException(status_code=404, detail="order not found")
-    
+    format = negotiate(request.headers.get("accept"))
     body = await request.body()
     try:
-        data = yaml.safe_load(body)
+        data = decode(body, request.headers.get("content-type"))
         updated_order = Orders(**data)
         if updated_order.order_id != order_id:
             raise HTTPException(status_code=400, detail="order ID in URL does not match payload")
-        orders[order_id] = updated_order
-        return yaml.dump({"message": "order updated", "order": updated_order.model_dump()}, sort_keys=False)
+        if order_id not in orders:
+            raise HTTPException(status_code=404, detail="order not found")
+        store_order(updated_order)
+        serialized.invalidate(order_id)
+        await persistence.commit([{"op": "put", "record": updated_order.model_dump()}])
+        return render({"message": "order updated", "order": updated_order.model_dump()}, format)
     except yaml.YAMLError:
         raise HTTPException(status_code=400, detail="Invalid YAML format")
     except ValueError as e:
         raise HTTPException(status_code=400, detail=str(e))
 
 @app.delete("/orders/{order_id}", response_class=PlainTextResponse)
-async def delete_order(order_id: int):
+async def delete_order(order_id: int, accept: Optional[str] = Header(None)):
     """
     Delete a order from the system.
     
     Args:
         order_id (int): The unique identifier of the order to delete
+        accept (str, optional): Accept header choosing YAML (default), JSON or MessagePack
     
     Returns:
-        PlainTextResponse: YAML formatted string confirming order deletion
+        Response: Confirmation of order deletion in the negotiated format
     
     Raises:
         HTTPException: 404 if order not found
     """
+    format = negotiate(accept)
     if order_id not in orders:
         raise HTTPException(status_code=404, detail="order not found")
-    del orders[order_id]
-    return yaml.dump({"message": f"order {order_id} deleted"}, sort_keys=False)
+    drop_order(order_id)
+    serialized.invalidate(order_id)
+    await persistence.commit([{"op": "delete", "id": order_id}])
+    return render({"message": f"order {order_id} deleted"}, format)
 
 # item management within orders
 @app.get("/orders/{order_id}/items", response_class=PlainTextResponse)
-async def get_order_item(order_id: int):
+async def get_order_item(order_id: int, accept: Optional[str] = Header(None)):
     """
     Retrieve the item list for a specific order.
     
     Args:
         order_id (int): The unique identifier of the order
+        accept (str, optional): Accept header choosing YAML (default), JSON or MessagePack
     
     Returns:
-        PlainTextResponse: YAML formatted string containing the order's items
+        Response: The order's items in the negotiated format
     
     Raises:
         HTTPException: 404 if order not found
     """
+    format = negotiate(accept)
     if order_id not in orders:
         raise HTTPException(status_code=404, detail="order not found")
-    return yaml.dump({"items": [item.model_dump() for item in orders[order_id].items]}, sort_keys=False)
+    return respond(await serialized.document(
+        order_id, "items", format, lambda: {"items": [item.model_dump() for item in orders[order_id].items.values()]}), format)
 
 @app.post("/orders/{order_id}/items", response_class=PlainTextResponse)
 async def add_order_item(order_id: int, request: Request):
@@ -180,29 +330,31 @@ async def add_order_item(order_id: int, request: Request):
     
     Args:
         order_id (int): The unique identifier of the order
-        request (Request): FastAPI request object containing YAML formatted item data
+        request (Request): FastAPI request object with item data in the format named by its Content-Type
     
     Returns:
-        PlainTextResponse: YAML formatted string confirming item addition
+        Response: Confirmation of item addition in the negotiated format
     
     Raises:
-        HTTPException: 404 if order not found, 400 if YAML is invalid or item ID exists
+        HTTPException: 404 if order not found, 400 if the body is invalid or item ID exists
     """
-    if order_id not in orders:
-        raise HTTPException(status_code=404, detail="order not found")
-    
+    format = negotiate(request.headers.get("accept"))
     body = await request.body()
     try:
-        data = yaml.safe_load(body)
+        data = decode(body, request.headers.get("content-type"))
         if data is None:
             raise HTTPException(status_code=400, detail="body must not be empty")
         item = InventoryItem(**data)
+        if order_id not in orders:
+            raise HTTPException(status_code=404, detail="order not found")
         order = orders[order_id]
         # Check if item already exists
-        if any(existing.item_id == item.item_id for existing in order.items):
+        if item.item_id in order.items:
             raise HTTPException(status_code=400, detail="Item ID already exists in this order")
-        order.items.append(item)
-        return yaml.dump({"message": "Item added", "item": item.model_dump()}, sort_keys=False)
+        order.items[item.item_id] = item
+        serialized.invalidate(order_id)
+        await persistence.commit([{"op": "put_item", "id": order_id, "item": item.model_dump()}])
+        return render({"message": "Item added", "item": item.model_dump()}, format)
     except yaml.YAMLError:
         raise HTTPException(status_code=400, detail="Invalid YAML format")
     except ValueError as e:
@@ -216,62 +368,65 @@ async def update_order_item(order_id: int, item_id: int, request: Request):
     Args:
         order_id (int): The unique identifier of the order
         item_id (int): The unique identifier of the item to update
-        request (Request): FastAPI request object containing YAML formatted item data
+        request (Request): FastAPI request object with item data in the format named by its Content-Type
     
     Returns:
-        PlainTextResponse: YAML formatted string confirming item update
+        Response: Confirmation of item update in the negotiated format
     
     Raises:
-        HTTPException: 404 if order or item not found, 400 if YAML is invalid or IDs don't match
+        HTTPException: 404 if order or item not found, 400 if the body is invalid or IDs don't match
     """
-
-    if order_id not in orders:
-        raise HTTPException(status_code=404, detail="order not found")
-    
-    order = orders[order_id]
+    format = negotiate(request.headers.get("accept"))
     body = await request.body()
     try:
-        data = yaml.safe_load(body)
+        data = decode(body, request.headers.get("content-type"))
         updated_item = InventoryItem(**data)
         if updated_item.item_id != item_id:
             raise HTTPException(status_code=400, detail="Item ID in URL does not match payload")
         
-        for i, item in enumerate(order.items):
-            if item.item_id == item_id:
-                order.items[i] = updated_item
-                return yaml.dump({"message": "Item updated", "item": updated_item.model_dump()}, sort_keys=False)
-        raise HTTPException(status_code=404, detail="Item not found in order")
+        # Look the order up only now: a DELETE or PUT may have replaced it
+        # while the body was being read.
+        if order_id not in orders:
+            raise HTTPException(status_code=404, detail="order not found")
+        order = orders[order_id]
+        if item_id not in order.items:
+            raise HTTPException(status_code=404, detail="Item not found in order")
+        order.items[item_id] = updated_item
+        serialized.invalidate(order_id)
+        await persistence.commit([{"op": "put_item", "id": order_id, "item": updated_item.model_dump()}])
+        return render({"message": "Item updated", "item": updated_item.model_dump()}, format)
     except yaml.YAMLError:
         raise HTTPException(status_code=400, detail="Invalid YAML format")
     except ValueError as e:
         raise HTTPException(status_code=400, detail=str(e))
 
 @app.delete("/orders/{order_id}/item/{item_id}", response_class=PlainTextResponse)
-async def delete_order_item(order_id: int, item_id: int):
+async def delete_order_item(order_id: int, item_id: int, accept: Optional[str] = Header(None)):
     """
     Delete an item from a specific order.
     
     Args:
         order_id (int): The unique identifier of the order
         item_id (int): The unique identifier of the item to delete
+        accept (str, optional): Accept header choosing YAML (default), JSON or MessagePack
     
     Returns:
-        PlainTextResponse: YAML formatted string confirming item deletion
+        Response: Confirmation of item deletion in the negotiated format
     
     Raises:
         HTTPException: 404 if order or item not found
     """
+    format = negotiate(accept)
     if order_id not in orders:
         raise HTTPException(status_code=404, detail="order not found")
     
     order = orders[order_id]
-    original_length = len(order.items)
-    order.items = [item for item in order.items if item.item_id != item_id]
-    
-    if len(order.items) == original_length:
+    if order.items.pop(item_id, None) is None:
         raise HTTPException(status_code=404, detail="Item not found in order")
 
-    return yaml.dump({"message": f"Item {item_id} deleted from order {order_id}"}, sort_keys=False)
+    serialized.invalidate(order_id)
+    await persistence.commit([{"op": "delete_item", "id": order_id, "item_id": item_id}])
+    return render({"message": f"Item {item_id} deleted from order {order_id}"}, format)
 
 if __name__ == "__main__":
     # Run with: python main.py  (or use uvicorn directly for production)
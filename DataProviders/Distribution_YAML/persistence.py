@@ -0,0 +1,237 @@
+import asyncio
+import json
+import os
+import threading
+from typing import Awaitable, Callable, Iterator, List
+
+from fastapi.concurrency import run_in_threadpool
+
+from serialization import encode
+
+Snapshot = Callable[[], Awaitable[bytes]]
+
+
+def write_snapshot(data_file: str, body: bytes):
+    """
+    Write a complete data file to a temporary file and atomically rename it into place.
+
+    Args:
+        data_file (str): Path of the data file to replace
+        body (bytes): The new contents
+    """
+    tmp_file = data_file + ".tmp"
+    with open(tmp_file, "wb") as f:
+        f.write(body)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_file, data_file)
+
+
+class MemoryPersistence:
+    """
+    Keeps mutations in memory only: the data file is read at startup and never
+    written, so a restart loses every change.
+    """
+
+    def load(self) -> Iterator[dict]:
+        return iter(())
+
+    def start(self):
+        pass
+
+    async def commit(self, entries: List[dict]):
+        pass
+
+    async def run(self, snapshot: Snapshot):
+        pass
+
+    async def close(self, snapshot: Snapshot):
+        pass
+
+
+class JournalPersistence:
+    """
+    Snapshot plus append-only journal.
+
+    Every mutation appends one JSON line describing the change to the journal,
+    so the cost of a write depends on the size of the change and not on the
+    number of resources. Lines are appended on the event loop, in mutation
+    order, and made durable on the threadpool; requests that commit while an
+    fsync is running share the next one. ``run`` periodically folds the journal
+    into a fresh data file written with an atomic rename, which bounds how much
+    journal a restart has to replay.
+
+    The entries are defined by the service, but each must set its target to
+    an absolute state (a put of the full record, a delete) so that replaying
+    one twice is harmless. That makes compaction crash-safe: the journal is
+    rotated to ``<journal>.old`` before the data file is written and only
+    removed after the data file is in place.
+    """
+
+    def __init__(self, data_file: str, journal_file: str, compact_interval: float = 60.0):
+        self.data_file = data_file
+        self.journal_file = journal_file
+        self.old_journal_file = journal_file + ".old"
+        self.compact_interval = compact_interval
+        self._lock = threading.Lock()
+        self._sync_lock = threading.Lock()
+        self._compacting = asyncio.Lock()
+        self._journal = None
+        self._written = 0
+        self._synced = 0
+        self._pending = 0
+
+    # ---------------- Startup ----------------
+    def load(self) -> Iterator[dict]:
+        """
+        Yield every journal entry written since the data file was last compacted.
+
+        Yields:
+            dict: The entries of ``<journal>.old``, then those of the journal
+        """
+        for path in (self.old_journal_file, self.journal_file):
+            if not os.path.exists(path):
+                continue
+            valid_bytes = 0
+            with open(path, "rb") as f:
+                for line in f:
+                    try:
+                        if not line.endswith(b"\n"):
+                            raise ValueError("incomplete line")
+                        entry = json.loads(line)
+                    except ValueError:
+                        # A torn final line from a crash mid-append; everything
+                        # before it is intact.
+                        break
+                    valid_bytes += len(line)
+                    self._pending += 1
+                    yield entry
+            if path == self.journal_file and valid_bytes < os.path.getsize(path):
+                # Drop the torn line so the next append starts on a clean line.
+                with open(path, "r+b") as f:
+                    f.truncate(valid_bytes)
+
+    def start(self):
+        """Open the journal for appending, once ``load`` has been replayed."""
+        if os.path.exists(self.old_journal_file):
+            # A compaction was interrupted. Put the old segment back in front of
+            # the journal so the next compaction folds both.
+            if os.path.exists(self.journal_file):
+                with open(self.old_journal_file, "rb") as f:
+                    body = f.read()
+                with open(self.journal_file, "rb") as f:
+                    body += f.read()
+                write_snapshot(self.journal_file, body)
+                os.remove(self.old_journal_file)
+            else:
+                os.replace(self.old_journal_file, self.journal_file)
+        self._journal = open(self.journal_file, "ab")
+
+    # ---------------- Mutations ----------------
+    async def commit(self, entries: List[dict]):
+        """
+        Append entries to the journal and wait until they are on disk.
+
+        Args:
+            entries (List[dict]): The changes, in the order they were applied
+        """
+        lines = b"".join(encode(entry, "json") + b"\n" for entry in entries)
+        with self._lock:
+            self._journal.write(lines)
+            self._journal.flush()
+            self._written += 1
+            self._pending += len(entries)
+            position = self._written
+        await run_in_threadpool(self._sync, position)
+
+    def _sync(self, position: int):
+        with self._sync_lock:
+            if self._synced >= position:
+                return
+            with self._lock:
+                target = self._written
+                # A duplicate descriptor stays valid if compaction rotates the
+                # journal meanwhile.
+                fd = os.dup(self._journal.fileno())
+            try:
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+            self._synced = max(self._synced, target)
+
+    # ---------------- Compaction ----------------
+    async def run(self, snapshot: Snapshot):
+        """
+        Compact the journal every ``compact_interval`` seconds until cancelled.
+
+        Args:
+            snapshot (Snapshot): Returns the complete data file for the current
+                state; it must capture that state before it first yields
+        """
+        while True:
+            await asyncio.sleep(self.compact_interval)
+            try:
+                await self.compact(snapshot)
+            except Exception as e:
+                print(f"Error compacting {self.journal_file}: {e}")
+
+    async def compact(self, snapshot: Snapshot):
+        """
+        Fold the journal into a new data file.
+
+        Args:
+            snapshot (Snapshot): Returns the complete data file for the current state
+        """
+        async with self._compacting:
+            if self._pending == 0:
+                return
+            # Rotate the journal and capture the state it describes in one
+            # step, so mutations that arrive afterwards land in the new segment.
+            with self._lock:
+                self._journal.flush()
+                os.fsync(self._journal.fileno())
+                self._synced = self._written
+                self._journal.close()
+                os.replace(self.journal_file, self.old_journal_file)
+                self._journal = open(self.journal_file, "ab")
+                self._pending = 0
+            body = await snapshot()
+            await run_in_threadpool(write_snapshot, self.data_file, body)
+            os.remove(self.old_journal_file)
+
+    async def close(self, snapshot: Snapshot):
+        """
+        Compact a last time and close the journal.
+
+        Args:
+            snapshot (Snapshot): Returns the complete data file for the current state
+        """
+        if self._journal is None:
+            return
+        await self.compact(snapshot)
+        with self._lock:
+            self._journal.close()
+            self._journal = None
+
+
+def open_persistence(mode: str, data_file: str, journal_file: str, compact_interval: float = 60.0):
+    """
+    Create the persistence layer selected by configuration.
+
+    Args:
+        mode (str): "journal" to persist every mutation, "memory" to keep them in memory only
+        data_file (str): Path of the YAML data file
+        journal_file (str): Path of the journal
+        compact_interval (float): Seconds between compactions of the journal
+
+    Returns:
+        The persistence layer
+
+    Raises:
+        ValueError: If the mode is unknown
+    """
+    if mode == "journal":
+        return JournalPersistence(data_file, journal_file, compact_interval)
+    if mode == "memory":
+        return MemoryPersistence()
+    raise ValueError(f"Unknown persistence mode: {mode!r} (expected 'journal' or 'memory')")
@@ -0,0 +1,75 @@
+import asyncio
+import importlib
+import os
+import shutil
+import sys
+
+import httpx
+import pytest
+import yaml
+
+SERVICE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+ITEM = """item_id: 1001
+name: Ethernet cable
+category: Electronics
+quantity: 5
+unit_price: 12.99
+supplier: Acme Corp
+"""
+
+
+@pytest.fixture
+def main(tmp_path, monkeypatch):
+    # main.py reads data/dc.yaml relative to the working directory,
+    # so run it against a copy and keep every change in memory.
+    shutil.copytree(os.path.join(SERVICE_DIR, "data"), tmp_path / "data")
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setenv("DISTRIBUTION_PERSISTENCE", "memory")
+    monkeypatch.syspath_prepend(SERVICE_DIR)
+    sys.modules.pop("main", None)
+    yield importlib.import_module("main")
+    sys.modules.pop("main", None)
+
+
+def send_while_deleting(main, method, url, body):
+    """
+    Send ``body`` in two parts and delete order 10001 between them, while the
+    handler is waiting for the rest of the body.
+    """
+    async def scenario():
+        gate = asyncio.Event()
+
+        async def chunks():
+            yield body[:5].encode()
+            await gate.wait()
+            yield body[5:].encode()
+
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            pending = asyncio.create_task(client.request(method, url, content=chunks()))
+            await asyncio.sleep(0.05)
+            assert (await client.delete("/orders/10001")).status_code == 200
+            gate.set()
+            return await pending
+
+    return asyncio.run(scenario())
+
+
+def test_update_order_item_after_order_deleted(main):
+    response = send_while_deleting(main, "PUT", "/orders/10001/items/1001", ITEM)
+    assert response.status_code == 404
+    assert 10001 not in main.orders
+
+
+def test_add_order_item_after_order_deleted(main):
+    response = send_while_deleting(main, "POST", "/orders/10001/items", ITEM.replace("1001", "4242"))
+    assert response.status_code == 404
+    assert 10001 not in main.orders
+
+
+def test_update_order_does_not_recreate_deleted_order(main):
+    order = yaml.safe_dump(main.orders[10001].model_dump(), sort_keys=False)
+    response = send_while_deleting(main, "PUT", "/orders/10001", order)
+    assert response.status_code == 404
+    assert 10001 not in main.orders
@@ -0,0 +1,106 @@
+from collections import OrderedDict
+from typing import Callable, Dict, Optional
+import gzip
+import json
+import threading
+
+from fastapi import Response
+
+
+def encode_json(content) -> bytes:
+    # Same encoding as fastapi.responses.JSONResponse.
+    return json.dumps(content, ensure_ascii=False, allow_nan=False, indent=None, separators=(",", ":")).encode("utf-8")
+
+
+class CachedBody:
+    """An encoded JSON body, tagged with the version it was built from."""
+
+    def __init__(self, version: int, body: bytes):
+        self.version = version
+        self.body = body
+        self._gzipped: Optional[bytes] = None
+
+    def gzipped(self) -> bytes:
+        if self._gzipped is None:
+            self._gzipped = gzip.compress(self.body, compresslevel=6)
+        return self._gzipped
+
+
+class ResponseCache:
+    """
+    Pre-serialized JSON bodies for the full collection and single records.
+
+    Entries are tagged with the collection or record version they were built
+    from and are only served while that version is current. The mutation
+    handlers also invalidate the entries they touch, which frees memory
+    straight away. Per-record entries are kept in an LRU of ``max_records``
+    entries. Gzip variants are compressed on first use and kept alongside the
+    plain bytes.
+    """
+
+    def __init__(self, max_records: int = 10000, gzip_enabled: bool = True, gzip_min_size: int = 1024):
+        self.max_records = max_records
+        self.gzip_enabled = gzip_enabled
+        self.gzip_min_size = gzip_min_size
+        self._lock = threading.Lock()
+        self._collection: Optional[CachedBody] = None
+        self._records: "OrderedDict[int, CachedBody]" = OrderedDict()
+        self._counters: Dict[str, int] = {"hits": 0, "misses": 0, "gzip_responses": 0, "invalidations": 0}
+
+    def collection(self, version: int, build: Callable[[], list]) -> CachedBody:
+        entry = self._collection
+        if entry is not None and entry.version == version:
+            self._count("hits")
+            return entry
+        self._count("misses")
+        entry = CachedBody(version, encode_json(build()))
+        self._collection = entry
+        return entry
+
+    def record(self, record_id: int, version: int, record: dict) -> CachedBody:
+        with self._lock:
+            entry = self._records.get(record_id)
+            if entry is not None and entry.version == version:
+                self._records.move_to_end(record_id)
+                self._counters["hits"] += 1
+                return entry
+            self._counters["misses"] += 1
+        entry = CachedBody(version, encode_json(record))
+        with self._lock:
+            self._records[record_id] = entry
+            self._records.move_to_end(record_id)
+            while len(self._records) > self.max_records:
+                self._records.popitem(last=False)
+        return entry
+
+    def invalidate(self, record_id: Optional[int] = None):
+        with self._lock:
+            self._collection = None
+            if record_id is not None:
+                self._records.pop(record_id, None)
+            self._counters["invalidations"] += 1
+
+    def respond(self, entry: CachedBody, accept_encoding: Optional[str], headers: Dict[str, str]) -> Response:
+        headers = dict(headers)
+        body = entry.body
+        if self.gzip_enabled and len(body) >= self.gzip_min_size:
+            headers["Vary"] = "Accept-Encoding"
+            if accept_encoding and "gzip" in accept_encoding:
+                body = entry.gzipped()
+                headers["Content-Encoding"] = "gzip"
+                self._count("gzip_responses")
+        return Response(content=body, media_type="application/json", headers=headers)
+
+    def metrics(self) -> dict:
+        with self._lock:
+            collection = self._collection
+            return {
+                **self._counters,
+                "records_cached": len(self._records),
+                "collection_bytes": len(collection.body) if collection is not None else 0,
+                "record_bytes": sum(len(entry.body) for entry in self._records.values()),
+            }
+
+    def _count(self, counter: str):
+        with self._lock:
+            self._counters[counter] += 1
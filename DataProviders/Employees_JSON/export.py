@@ -0,0 +1,57 @@
+from typing import Callable, Iterator, List, Optional, Sequence, Tuple
+import csv
+import io
+import json
+import zlib
+
+FORMATS = {
+    "ndjson": ("application/x-ndjson", "ndjson"),
+    "csv": ("text/csv; charset=utf-8", "csv"),
+}
+
+
+def _ndjson(records: List[dict], columns: Sequence[str]) -> str:
+    return "".join(json.dumps({c: r.get(c) for c in columns}, ensure_ascii=False, separators=(",", ":")) + "\n"
+                   for r in records)
+
+
+def _csv(records: List[dict], columns: Sequence[str]) -> str:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator="\n")
+    writer.writerows([r.get(c) for c in columns] for r in records)
+    return buffer.getvalue()
+
+
+def export_chunks(fetch_page: Callable[[Optional[int], int], Tuple[List[dict], Optional[int]]],
+                  format: str, columns: Sequence[str], chunk_size: int = 1000,
+                  compress: bool = False) -> Iterator[bytes]:
+    """
+    Yield the collection as NDJSON or CSV, one encoded chunk per page.
+
+    ``fetch_page(after, limit)`` is the store's keyset ``page``: each chunk
+    holds at most ``chunk_size`` records and the next one resumes after the
+    last id, so memory use depends on the chunk size and not on the size of
+    the collection. Like cursor pagination, records changed while the export
+    runs show up as they are when their page is read. With ``compress`` the
+    output is a single gzip stream, compressed chunk by chunk.
+    """
+    encode = _ndjson if format == "ndjson" else _csv
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31) if compress else None
+
+    def emit(text: str) -> bytes:
+        data = text.encode("utf-8")
+        return compressor.compress(data) if compressor is not None else data
+
+    if format == "csv":
+        yield emit(_csv([dict(zip(columns, columns))], columns))
+    after = None
+    while True:
+        records, after = fetch_page(after, chunk_size)
+        if records:
+            chunk = emit(encode(records, columns))
+            if chunk:
+                yield chunk
+        if after is None:
+            break
+    if compressor is not None:
+        yield compressor.flush()
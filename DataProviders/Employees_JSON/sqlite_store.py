@@ -0,0 +1,419 @@
+from contextlib import contextmanager
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from search import tokenize
+from store import GroupAggregate, StoreSnapshot
+
+# Ids per "IN (...)" lookup; well under SQLite's bound-parameter limit.
+LOOKUP_CHUNK = 500
+
+
+def encode(record: dict) -> str:
+    return json.dumps(record, ensure_ascii=False, separators=(",", ":"))
+
+
+class SQLiteAggregate:
+    """The running totals of one ``GroupAggregate``, read from the database."""
+
+    def __init__(self, store: "SQLiteStore", name: str, spec: GroupAggregate):
+        self.store = store
+        self.name = name
+        self.spec = spec
+
+    def groups(self) -> Dict[object, Dict[str, float]]:
+        groups: Dict[object, Dict[str, float]] = {}
+        rows = self.store._connection().execute(
+            "SELECT group_key, measure, value FROM aggregates WHERE name = ?", (self.name,))
+        for key, measure, value in rows:
+            group = groups.setdefault(json.loads(key), {"count": 0, **{m: 0 for m in self.spec.measures}})
+            group[measure] = value
+        return groups
+
+
+class SQLiteSearch:
+    """The FTS5 table behind ``SQLiteStore.search``."""
+
+    def __init__(self, store: "SQLiteStore", fields: Tuple[str, ...]):
+        self.store = store
+        self.fields = fields
+
+    def text(self, record: dict) -> str:
+        return " ".join(str(record.get(field) or "") for field in self.fields)
+
+    def metrics(self) -> dict:
+        return {"engine": "fts5", "fields": list(self.fields)}
+
+
+class SQLiteStore:
+    """
+    Records kept in an SQLite database, with the interface of ``RecordStore``,
+    so that several worker processes can share one consistent store.
+
+    Each record is a JSON document in the ``records`` table, keyed by id.
+    ``indexed_fields`` and ``range_fields`` get expression indexes on
+    ``json_extract(body, '$.<field>')``, which the filter and ordering
+    queries use. The collection version, the id allocator, the change log
+    and the totals of ``aggregates`` are tables too. They are updated in the
+    same transaction as the record, so every process sees the same ETags,
+    deltas and stats. ``text_fields`` are indexed in an FTS5 table for
+    ``search``, which matches each query word as a prefix and ranks with
+    bm25.
+
+    The database runs in WAL mode, so readers never wait for the writer.
+    Every thread has its own connection. Mutations run in ``BEGIN IMMEDIATE``
+    transactions, so SQLite serializes writers across processes.
+    """
+
+    def __init__(self, path: str, first_id: int = 1,
+                 indexed_fields: Iterable[str] = (), range_fields: Iterable[str] = (),
+                 aggregates: Optional[Dict[str, GroupAggregate]] = None,
+                 text_fields: Iterable[str] = ()):
+        self.path = path
+        self.indexed_fields = tuple(indexed_fields)
+        self.range_fields = tuple(range_fields)
+        for field in self.indexed_fields + self.range_fields:
+            if not field.isidentifier():
+                raise ValueError(f"Cannot index field {field!r}")
+        self._specs = aggregates or {}
+        self.aggregates = {name: SQLiteAggregate(self, name, spec) for name, spec in self._specs.items()}
+        text_fields = tuple(text_fields)
+        self.text_index = SQLiteSearch(self, text_fields) if text_fields else None
+        self._local = threading.local()
+        self._connections: List[sqlite3.Connection] = []
+        self._connections_lock = threading.Lock()
+        self._connection().execute("PRAGMA journal_mode=WAL")
+        with self.transaction() as connection:
+            connection.execute("CREATE TABLE IF NOT EXISTS records (id INTEGER PRIMARY KEY, body TEXT NOT NULL)")
+            connection.execute("CREATE TABLE IF NOT EXISTS changes (id INTEGER PRIMARY KEY, version INTEGER NOT NULL)")
+            connection.execute("CREATE INDEX IF NOT EXISTS changes_version ON changes (version)")
+            connection.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value)")
+            connection.execute("CREATE TABLE IF NOT EXISTS aggregates "
+                               "(name TEXT, group_key TEXT, measure TEXT, value, PRIMARY KEY (name, group_key, measure))")
+            for field in self.indexed_fields + self.range_fields:
+                connection.execute(f"CREATE INDEX IF NOT EXISTS records_{field} ON records ({self._field(field)})")
+            if self.text_index is not None:
+                connection.execute("CREATE VIRTUAL TABLE IF NOT EXISTS search USING fts5 (text, content='', prefix='2 3')")
+            now = time.time_ns() // 1000
+            connection.executemany("INSERT OR IGNORE INTO meta (key, value) VALUES (?, ?)", [
+                ("version", now), ("horizon", now), ("next_id", first_id),
+                ("records", 0), ("deleted", 0), ("seeded", 0),
+            ])
+
+    # ---------------- Connections ----------------
+    def _connection(self) -> sqlite3.Connection:
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=30, isolation_level=None, check_same_thread=False)
+            self._local.connection = connection
+            with self._connections_lock:
+                self._connections.append(connection)
+        return connection
+
+    @contextmanager
+    def transaction(self, write: bool = True) -> Iterator[sqlite3.Connection]:
+        """
+        Run the enclosed statements in one transaction; nested calls join the
+        outer one. ``write=False`` gives a consistent read-only snapshot.
+        """
+        connection = self._connection()
+        if connection.in_transaction:
+            yield connection
+            return
+        connection.execute("BEGIN IMMEDIATE" if write else "BEGIN")
+        try:
+            yield connection
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+        connection.execute("COMMIT")
+
+    def close(self):
+        with self._connections_lock:
+            for connection in self._connections:
+                connection.close()
+            self._connections.clear()
+
+    # ---------------- Reads ----------------
+    @property
+    def version(self) -> int:
+        return self._meta(self._connection(), "version")
+
+    @property
+    def horizon(self) -> int:
+        return self._meta(self._connection(), "horizon")
+
+    def snapshot(self) -> StoreSnapshot:
+        with self.transaction(write=False) as connection:
+            return StoreSnapshot(self._meta(connection, "version"), self._meta(connection, "horizon"),
+                                 {name: aggregate.groups() for name, aggregate in self.aggregates.items()})
+
+    def load(self, entries: Iterable[dict], progress=None):
+        """
+        Seed the database from persisted entries, the way ``RecordStore.load``
+        fills memory. This happens once: when the database has already been
+        seeded (by this or another worker process), ``entries`` is not read.
+        """
+        with self.transaction() as connection:
+            if self._meta(connection, "seeded"):
+                return
+            next_id = self._meta(connection, "next_id")
+            for entry in entries:
+                if entry["op"] == "put":
+                    record = entry["record"]
+                    connection.execute("INSERT OR REPLACE INTO records (id, body) VALUES (?, ?)",
+                                       (record["id"], encode(record)))
+                    next_id = max(next_id, record["id"] + 1)
+                else:
+                    connection.execute("DELETE FROM records WHERE id = ?", (entry["id"],))
+                if progress is not None:
+                    progress.entries += 1
+            totals = {name: GroupAggregate(spec.group_field, spec.measures) for name, spec in self._specs.items()}
+            count = 0
+            for (body,) in connection.execute("SELECT body FROM records"):
+                record = json.loads(body)
+                count += 1
+                for aggregate in totals.values():
+                    aggregate.add(record)
+                if self.text_index is not None:
+                    connection.execute("INSERT INTO search (rowid, text) VALUES (?, ?)",
+                                       (record["id"], self.text_index.text(record)))
+            for name, aggregate in totals.items():
+                connection.executemany("INSERT INTO aggregates (name, group_key, measure, value) VALUES (?, ?, ?, ?)", [
+                    (name, json.dumps(key), measure, value)
+                    for key, group in aggregate.groups().items() for measure, value in group.items()
+                ])
+            self._set_meta(connection, next_id=next_id, records=count, seeded=1)
+
+    def __len__(self) -> int:
+        return self._meta(self._connection(), "records")
+
+    def __contains__(self, record_id: int) -> bool:
+        return self._connection().execute("SELECT 1 FROM records WHERE id = ?", (record_id,)).fetchone() is not None
+
+    def all(self) -> List[dict]:
+        return [json.loads(body) for (body,) in self._connection().execute("SELECT body FROM records ORDER BY id")]
+
+    def get(self, record_id: int) -> Optional[dict]:
+        return self._get(self._connection(), record_id)
+
+    def get_many(self, record_ids: Iterable[int]) -> Tuple[List[dict], List[int]]:
+        """
+        Look up ``record_ids`` in order, returning the records found and the
+        ids that were not. Repeated ids are only looked up once.
+        """
+        requested = list(dict.fromkeys(record_ids))
+        found: Dict[int, dict] = {}
+        connection = self._connection()
+        for start in range(0, len(requested), LOOKUP_CHUNK):
+            chunk = requested[start:start + LOOKUP_CHUNK]
+            rows = connection.execute(f"SELECT id, body FROM records WHERE id IN ({','.join('?' * len(chunk))})", chunk)
+            found.update((record_id, json.loads(body)) for record_id, body in rows)
+        return [found[i] for i in requested if i in found], [i for i in requested if i not in found]
+
+    def query(self, equals: Optional[Dict[str, object]] = None,
+              ranges: Optional[Dict[str, Tuple[object, object]]] = None,
+              order_by: str = "id", descending: bool = False,
+              limit: Optional[int] = None) -> List[dict]:
+        """
+        Return the records matching every filter, ordered by ``order_by``,
+        with the same semantics as ``RecordStore.query``.
+        """
+        clauses: List[str] = []
+        params: List[object] = []
+        for field, value in (equals or {}).items():
+            clauses.append(f"{self._field(field)} = ?")
+            params.append(value)
+        for field, (low, high) in (ranges or {}).items():
+            clauses.append(f"{self._field(field)} IS NOT NULL")
+            if low is not None:
+                clauses.append(f"{self._field(field)} >= ?")
+                params.append(low)
+            if high is not None:
+                clauses.append(f"{self._field(field)} <= ?")
+                params.append(high)
+        direction = "DESC" if descending else "ASC"
+        if order_by == "id":
+            order = f"id {direction}"
+        else:
+            clauses.append(f"{self._field(order_by)} IS NOT NULL")
+            order = f"{self._field(order_by)} {direction}, id {direction}"
+        sql = "SELECT body FROM records"
+        if clauses:
+            sql += " WHERE " + " AND ".join(clauses)
+        sql += f" ORDER BY {order}"
+        if limit is not None:
+            sql += " LIMIT ?"
+            params.append(limit)
+        return [json.loads(body) for (body,) in self._connection().execute(sql, params)]
+
+    def search(self, text: str, limit: int) -> List[dict]:
+        """Return up to ``limit`` records matching ``text``, best match first."""
+        if self.text_index is None:
+            raise ValueError("This store has no text index")
+        terms = list(dict.fromkeys(tokenize(text)))
+        if not terms:
+            return []
+        match = " AND ".join(f'"{term}"*' for term in terms)
+        rows = self._connection().execute(
+            "SELECT records.body FROM search JOIN records ON records.id = search.rowid "
+            "WHERE search MATCH ? ORDER BY search.rank, records.id LIMIT ?", (match, limit))
+        return [json.loads(body) for (body,) in rows]
+
+    def record_version(self, record_id: int) -> int:
+        row = self._connection().execute("SELECT version FROM changes WHERE id = ?", (record_id,)).fetchone()
+        return row[0] if row is not None else self.horizon
+
+    def changes_since(self, version: int, until: Optional[int] = None) -> Tuple[List[dict], List[int]]:
+        """
+        Return the records created or updated and the ids deleted after
+        ``version``, oldest change first. Raises ``ValueError`` if the change
+        log no longer reaches back to ``version``. Changes made after
+        ``until`` (a snapshot's version) are left for the next call.
+        """
+        entries = self.change_log(version, until)
+        return ([record for _, _, record in entries if record is not None],
+                [record_id for _, record_id, record in entries if record is None])
+
+    def change_log(self, version: int, until: Optional[int] = None) -> List[Tuple[int, int, Optional[dict]]]:
+        """
+        Return ``(changed_at, id, record)`` for every record changed after
+        ``version`` and no later than ``until``, oldest change first, with
+        ``record`` None for a delete. Raises ``ValueError`` like ``changes_since``.
+        """
+        with self.transaction(write=False) as connection:
+            if version < self._meta(connection, "horizon") or version > self._meta(connection, "version"):
+                raise ValueError(f"Version {version} is outside the change log")
+            rows = connection.execute(
+                "SELECT changes.version, changes.id, records.body FROM changes LEFT JOIN records ON records.id = changes.id "
+                "WHERE changes.version > ? AND changes.version <= ? ORDER BY changes.version",
+                (version, until if until is not None else 2 ** 63 - 1)).fetchall()
+        return [(changed_at, record_id, json.loads(body) if body is not None else None)
+                for changed_at, record_id, body in rows]
+
+    def page(self, after: Optional[int], limit: int) -> Tuple[List[dict], Optional[int]]:
+        """
+        Return up to ``limit`` records with ids greater than ``after`` in id
+        order, plus the cursor for the next page (``None`` on the last page).
+        """
+        rows = self._connection().execute("SELECT body FROM records WHERE id > ? ORDER BY id LIMIT ?",
+                                          (after if after is not None else -2 ** 63, limit + 1)).fetchall()
+        page = [json.loads(body) for (body,) in rows[:limit]]
+        return page, (page[-1]["id"] if len(rows) > limit else None)
+
+    # ---------------- Writes ----------------
+    def insert(self, record: dict) -> dict:
+        with self.transaction() as connection:
+            record["id"] = self._meta(connection, "next_id")
+            connection.execute("INSERT INTO records (id, body) VALUES (?, ?)", (record["id"], encode(record)))
+            self._index(connection, record)
+            self._set_meta(connection, next_id=record["id"] + 1, records=self._meta(connection, "records") + 1)
+            self._touch(connection, record["id"])
+        return record
+
+    def update(self, record_id: int, changes: dict) -> Optional[dict]:
+        with self.transaction() as connection:
+            previous = self._get(connection, record_id)
+            if previous is None:
+                return None
+            record = {**previous, **changes}
+            connection.execute("UPDATE records SET body = ? WHERE id = ?", (encode(record), record_id))
+            self._unindex(connection, previous)
+            self._index(connection, record)
+            self._touch(connection, record_id)
+        return record
+
+    def delete(self, record_id: int) -> Optional[dict]:
+        with self.transaction() as connection:
+            record = self._get(connection, record_id)
+            if record is None:
+                return None
+            connection.execute("DELETE FROM records WHERE id = ?", (record_id,))
+            self._unindex(connection, record)
+            self._touch(connection, record_id)
+            records = self._meta(connection, "records") - 1
+            deleted = self._meta(connection, "deleted") + 1
+            self._set_meta(connection, records=records, deleted=deleted)
+            if deleted > max(1024, records):
+                self._forget_deletes(connection, deleted)
+        return record
+
+    def metrics(self) -> dict:
+        wal = self.path + "-wal"
+        with self.transaction(write=False) as connection:
+            return {
+                "engine": "sqlite",
+                "path": self.path,
+                "records": self._meta(connection, "records"),
+                "version": self._meta(connection, "version"),
+                "changes": connection.execute("SELECT COUNT(*) FROM changes").fetchone()[0],
+                "db_bytes": os.path.getsize(self.path),
+                "wal_bytes": os.path.getsize(wal) if os.path.exists(wal) else 0,
+            }
+
+    # ---------------- Internals ----------------
+    @staticmethod
+    def _field(field: str) -> str:
+        if not field.isidentifier():
+            raise ValueError(f"Invalid field name: {field!r}")
+        return f"json_extract(body, '$.{field}')"
+
+    @staticmethod
+    def _meta(connection: sqlite3.Connection, key: str):
+        return connection.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()[0]
+
+    @staticmethod
+    def _set_meta(connection: sqlite3.Connection, **values):
+        connection.executemany("UPDATE meta SET value = ? WHERE key = ?", [(v, k) for k, v in values.items()])
+
+    @staticmethod
+    def _get(connection: sqlite3.Connection, record_id: int) -> Optional[dict]:
+        row = connection.execute("SELECT body FROM records WHERE id = ?", (record_id,)).fetchone()
+        return json.loads(row[0]) if row is not None else None
+
+    def _touch(self, connection: sqlite3.Connection, record_id: int):
+        version = self._meta(connection, "version") + 1
+        self._set_meta(connection, version=version)
+        connection.execute("INSERT INTO changes (id, version) VALUES (?, ?) "
+                           "ON CONFLICT (id) DO UPDATE SET version = excluded.version", (record_id, version))
+
+    def _forget_deletes(self, connection: sqlite3.Connection, deleted: int):
+        # Drop the oldest half of the change log's deletes, along with any
+        # updates interleaved with them, and move the horizon past them.
+        target = deleted // 2
+        (horizon,) = connection.execute(
+            "SELECT changes.version FROM changes LEFT JOIN records ON records.id = changes.id "
+            "WHERE records.id IS NULL ORDER BY changes.version LIMIT 1 OFFSET ?", (deleted - target - 1,)).fetchone()
+        connection.execute("DELETE FROM changes WHERE version <= ?", (horizon,))
+        self._set_meta(connection, horizon=horizon, deleted=target)
+
+    def _index(self, connection: sqlite3.Connection, record: dict):
+        if self.text_index is not None:
+            connection.execute("INSERT INTO search (rowid, text) VALUES (?, ?)",
+                               (record["id"], self.text_index.text(record)))
+        self._aggregate(connection, record, 1)
+
+    def _unindex(self, connection: sqlite3.Connection, record: dict):
+        if self.text_index is not None:
+            connection.execute("INSERT INTO search (search, rowid, text) VALUES ('delete', ?, ?)",
+                               (record["id"], self.text_index.text(record)))
+        self._aggregate(connection, record, -1)
+
+    def _aggregate(self, connection: sqlite3.Connection, record: dict, sign: int):
+        for name, spec in self._specs.items():
+            key = json.dumps(record.get(spec.group_field))
+            deltas = {"count": sign, **{measure: sign * f(record) for measure, f in spec.measures.items()}}
+            connection.executemany(
+                "INSERT INTO aggregates (name, group_key, measure, value) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT (name, group_key, measure) DO UPDATE SET value = value + excluded.value",
+                [(name, key, measure, delta) for measure, delta in deltas.items()])
+            if sign < 0:
+                # Like GroupAggregate, drop a group once its last record is gone.
+                connection.execute(
+                    "DELETE FROM aggregates WHERE name = ? AND group_key = ? AND "
+                    "(SELECT value FROM aggregates WHERE name = ? AND group_key = ? AND measure = 'count') = 0",
+                    (name, key, name, key))
@@ -0,0 +1,508 @@
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict
+from contextlib import nullcontext
+from typing import Callable, Dict, Iterable, Iterator, List, MutableMapping, NamedTuple, Optional, Set, Tuple
+import time
+
+from search import TextIndex
+
+
+def paginate(records: List[dict], after: Optional[int], limit: int) -> Tuple[List[dict], Optional[int]]:
+    """Cursor-paginate a list of records that is already sorted by id."""
+    start = 0 if after is None else bisect_right(records, after, key=lambda r: r["id"])
+    page = records[start:start + limit]
+    next_cursor = page[-1]["id"] if start + limit < len(records) else None
+    return page, next_cursor
+
+
+class SortedIndex:
+    """
+    Ascending ``(value, id)`` pairs for one numeric field.
+
+    Range bounds are located by binary search, and walking the pairs from
+    either end yields the k smallest or largest values without sorting. The
+    pairs are kept in blocks of up to ``2 * BLOCK_SIZE``, each block two
+    parallel typed arrays: 16 bytes per record rather than a tuple and two
+    boxed numbers. ``add`` and ``remove`` find the block from the list of
+    block maxima and edit that block in place, so keeping the index current
+    costs O(log n + BLOCK_SIZE) however large the collection grows. A block
+    that outgrows the limit is split in two and an empty one is dropped.
+
+    Only the store's single writer changes the index; readers walk it inside
+    ``MutationQueue.read``, which retries a read that overlapped a change.
+    """
+
+    BLOCK_SIZE = 512
+
+    def __init__(self):
+        self._values: List[array] = []
+        self._ids: List[array] = []
+        self._maxes: List[Tuple[float, int]] = []
+
+    def rebuild(self, pairs: Iterable[Tuple[object, int]]):
+        entries = sorted(pair for pair in pairs if pair[0] is not None)
+        blocks = [entries[i:i + self.BLOCK_SIZE] for i in range(0, len(entries), self.BLOCK_SIZE)]
+        self._values = [array("d", (value for value, _ in block)) for block in blocks]
+        self._ids = [array("q", (record_id for _, record_id in block)) for block in blocks]
+        self._maxes = [block[-1] for block in blocks]
+
+    def __len__(self) -> int:
+        return sum(map(len, self._ids))
+
+    @staticmethod
+    def _position(values: array, ids: array, value, record_id: int) -> int:
+        start = bisect_left(values, value)
+        stop = bisect_right(values, value, start)
+        return bisect_left(ids, record_id, start, stop)
+
+    def add(self, value, record_id: int):
+        if value is None:
+            return
+        if not self._maxes:
+            self._values.append(array("d", (value,)))
+            self._ids.append(array("q", (record_id,)))
+            self._maxes.append((value, record_id))
+            return
+        block = min(bisect_left(self._maxes, (value, record_id)), len(self._maxes) - 1)
+        values, ids = self._values[block], self._ids[block]
+        position = self._position(values, ids, value, record_id)
+        values.insert(position, value)
+        ids.insert(position, record_id)
+        self._maxes[block] = (values[-1], ids[-1])
+        if len(values) > 2 * self.BLOCK_SIZE:
+            half = len(values) // 2
+            self._values[block:block + 1] = [values[:half], values[half:]]
+            self._ids[block:block + 1] = [ids[:half], ids[half:]]
+            self._maxes[block:block + 1] = [(values[half - 1], ids[half - 1]), (values[-1], ids[-1])]
+
+    def remove(self, value, record_id: int):
+        if value is None:
+            return
+        block = bisect_left(self._maxes, (value, record_id))
+        if block == len(self._maxes):
+            return
+        values, ids = self._values[block], self._ids[block]
+        position = self._position(values, ids, value, record_id)
+        if position < len(ids) and ids[position] == record_id and values[position] == value:
+            del values[position]
+            del ids[position]
+            if ids:
+                self._maxes[block] = (values[-1], ids[-1])
+            else:
+                del self._values[block], self._ids[block], self._maxes[block]
+
+    def _locate(self, value, right: bool) -> Tuple[int, int]:
+        # (block, position) of the first pair above value (right) or at or
+        # above it (left).
+        search = bisect_right if right else bisect_left
+        block = search(self._maxes, value, key=lambda pair: pair[0])
+        if block == len(self._maxes):
+            return block, 0
+        return block, search(self._values[block], value)
+
+    def _bounds(self, low, high) -> Tuple[Tuple[int, int], Tuple[int, int]]:
+        start = (0, 0) if low is None else self._locate(low, False)
+        stop = (len(self._ids), 0) if high is None else self._locate(high, True)
+        return start, max(start, stop)
+
+    def span(self, low=None, high=None) -> Tuple[int, int]:
+        (start_block, start), (stop_block, stop) = self._bounds(low, high)
+        lengths = [len(ids) for ids in self._ids[:stop_block]]
+        start += sum(lengths[:start_block])
+        return start, max(start, sum(lengths) + stop)
+
+    def ids(self, low=None, high=None, descending: bool = False) -> Iterator[int]:
+        start, stop = self._bounds(low, high)
+        if descending:
+            block, position = stop
+            while (block, position) > start:
+                if position == 0:
+                    block -= 1
+                    position = len(self._ids[block])
+                    continue
+                ids = self._ids[block]
+                first = start[1] if block == start[0] else 0
+                for index in range(position - 1, first - 1, -1):
+                    yield ids[index]
+                position = first
+        else:
+            block, position = start
+            while (block, position) < stop:
+                ids = self._ids[block]
+                end = stop[1] if block == stop[0] else len(ids)
+                for index in range(position, end):
+                    yield ids[index]
+                block, position = block + 1, 0
+
+
+class GroupAggregate:
+    """
+    Running record count and sums of ``measures`` per value of ``group_field``.
+
+    ``add`` and ``remove`` are O(number of measures), so the aggregate is
+    kept current by the store on every mutation and read in O(groups).
+    """
+
+    def __init__(self, group_field: str, measures: Dict[str, Callable[[dict], float]]):
+        self.group_field = group_field
+        self.measures = measures
+        self._groups: Dict[object, Dict[str, float]] = {}
+
+    def add(self, record: dict):
+        group = self._groups.setdefault(record.get(self.group_field), {"count": 0, **{m: 0 for m in self.measures}})
+        group["count"] += 1
+        for name, measure in self.measures.items():
+            group[name] += measure(record)
+
+    def remove(self, record: dict):
+        key = record.get(self.group_field)
+        group = self._groups[key]
+        group["count"] -= 1
+        if group["count"] == 0:
+            del self._groups[key]
+            return
+        for name, measure in self.measures.items():
+            group[name] -= measure(record)
+
+    def groups(self) -> Dict[object, Dict[str, float]]:
+        return {key: dict(group) for key, group in self._groups.items()}
+
+
+class StoreSnapshot(NamedTuple):
+    """
+    The read state of a store at one version: its change-log bounds and a
+    copy of every aggregate's groups. It is never modified once taken.
+    """
+    version: int
+    horizon: int
+    aggregates: Dict[str, Dict[object, Dict[str, float]]]
+
+
+class RecordStore:
+    """
+    In-memory collection of JSON records keyed by their integer ``id``.
+
+    Records live in a single dict. Python dicts keep insertion order, so the
+    same structure is both the id index (O(1) lookup, update and delete) and
+    the ordered collection returned by the list endpoint. New ids come from a
+    monotonic allocator instead of a scan over every existing id.
+
+    For cursor pagination the store also keeps every id in ascending order.
+    Because ids are allocated monotonically, inserts only ever append to that
+    list; deletes leave a tombstone that paging skips, and the list is
+    compacted once tombstones outnumber live records.
+
+    ``indexed_fields`` get a secondary hash index (value -> set of ids) that
+    is updated on every insert, update and delete, so equality filters cost
+    O(matching records) rather than O(collection). ``range_fields`` get a
+    ``SortedIndex`` used for min/max filters and ordered top-k queries.
+    ``aggregates`` are ``GroupAggregate`` instances kept in step with the
+    same mutations.
+
+    ``text_index`` is a ``TextIndex`` over the record's text fields, also
+    kept current on every mutation, and backs ``search``.
+
+    ``table`` replaces the dict that holds the records, e.g. with a
+    ``ColumnarTable``. Such a table may hand out copies, so updated records
+    are always written back to it. It reports its own ``metrics``.
+
+    Every mutation bumps ``version`` and moves the record's id to the end of
+    a change log, so the changes since a given version can be read from the
+    tail of the log in O(changes). Versions start from the wall clock in
+    microseconds, which keeps them increasing across restarts; a client whose
+    version predates ``horizon`` (the start of the process, or the point up to
+    which deletes have been forgotten) has to fetch the full collection again.
+
+    The store is written by one thread at a time (see ``MutationQueue``) and
+    read from any number of threads without a lock. A stored record is never
+    changed in place: ``update`` replaces it with a new dict, so a reader
+    holding a record never sees it half updated. Readers iterate over copies
+    of index buckets; the range indexes are edited in place, so a query that
+    walks them runs inside ``MutationQueue.read``. ``snapshot`` captures the
+    version and aggregates for readers to answer from.
+    """
+
+    def __init__(self, records: Iterable[dict] = (), first_id: int = 1,
+                 indexed_fields: Iterable[str] = (), range_fields: Iterable[str] = (),
+                 aggregates: Optional[Dict[str, GroupAggregate]] = None,
+                 text_index: Optional[TextIndex] = None,
+                 table: Optional[MutableMapping[int, dict]] = None):
+        self.version = time.time_ns() // 1000
+        self.horizon = self.version
+        self._changes: "OrderedDict[int, int]" = OrderedDict()
+        self._deleted = 0
+        self._records: MutableMapping[int, dict] = table if table is not None else {}
+        self._next_id = first_id
+        self._indexes: Dict[str, Dict[object, Set[int]]] = {field: {} for field in indexed_fields}
+        self._sorted: Dict[str, SortedIndex] = {field: SortedIndex() for field in range_fields}
+        self.aggregates: Dict[str, GroupAggregate] = aggregates or {}
+        self.text_index = text_index
+        self._ids = array("q")
+        self._tombstones = 0
+        self.load({"op": "put", "record": record} for record in records)
+
+    def load(self, entries: Iterable[dict], progress=None):
+        """
+        Apply persisted entries (``{"op": "put", "record": ...}`` or
+        ``{"op": "delete", "id": ...}``) as they are streamed from disk.
+
+        Loading does not bump the version or record changes; it is meant to
+        run before the service starts answering requests. The sorted indexes
+        are rebuilt with one sort at the end rather than an insert per record.
+        """
+        sorted_indexes, self._sorted = self._sorted, {}
+        try:
+            for entry in entries:
+                if entry["op"] == "put":
+                    record = entry["record"]
+                    existing = self._records.get(record["id"])
+                    if existing is not None:
+                        self._unindex(existing)
+                    self._records[record["id"]] = record
+                    self._next_id = max(self._next_id, record["id"] + 1)
+                    self._index(record)
+                else:
+                    existing = self._records.pop(entry["id"], None)
+                    if existing is not None:
+                        self._unindex(existing)
+                if progress is not None:
+                    progress.entries += 1
+        finally:
+            self._sorted = sorted_indexes
+            for field, index in self._sorted.items():
+                index.rebuild((record.get(field), record_id) for record_id, record in self._records.items())
+            self._ids = array("q", sorted(self._records))
+            self._tombstones = 0
+
+    def transaction(self, write: bool = True):
+        """
+        Group several mutations into one unit. In memory this is a no-op:
+        callers serialize writers and validate a batch before applying it.
+        """
+        return nullcontext(self)
+
+    def snapshot(self) -> StoreSnapshot:
+        return StoreSnapshot(self.version, self.horizon,
+                             {name: aggregate.groups() for name, aggregate in self.aggregates.items()})
+
+    def metrics(self) -> dict:
+        if isinstance(self._records, dict):
+            return {"engine": "dict", "records": len(self._records)}
+        return self._records.metrics()
+
+    def __len__(self) -> int:
+        return len(self._records)
+
+    def __contains__(self, record_id: int) -> bool:
+        return record_id in self._records
+
+    def all(self) -> List[dict]:
+        return list(self._records.values())
+
+    def get(self, record_id: int) -> Optional[dict]:
+        return self._records.get(record_id)
+
+    def get_many(self, record_ids: Iterable[int]) -> Tuple[List[dict], List[int]]:
+        """
+        Look up ``record_ids`` in order, returning the records found and the
+        ids that were not. Repeated ids are only looked up once.
+        """
+        found: List[dict] = []
+        missing: List[int] = []
+        for record_id in dict.fromkeys(record_ids):
+            record = self._records.get(record_id)
+            if record is None:
+                missing.append(record_id)
+            else:
+                found.append(record)
+        return found, missing
+
+    def query(self, equals: Optional[Dict[str, object]] = None,
+              ranges: Optional[Dict[str, Tuple[object, object]]] = None,
+              order_by: str = "id", descending: bool = False,
+              limit: Optional[int] = None) -> List[dict]:
+        """
+        Return the records matching every filter, ordered by ``order_by``.
+
+        ``equals`` maps fields to required values and ``ranges`` maps fields to
+        inclusive ``(low, high)`` bounds, either of which may be ``None``.
+        When ``order_by`` is a range-indexed field the records are read from
+        that index in order and the scan stops after ``limit`` matches, so a
+        top-k query does not sort the collection. Otherwise candidates come
+        from the smallest index bucket or range slice and are checked against
+        the remaining filters.
+        """
+        equals = equals or {}
+        ranges = ranges or {}
+
+        def matches(record: dict) -> bool:
+            for field, value in equals.items():
+                if record.get(field) != value:
+                    return False
+            for field, (low, high) in ranges.items():
+                value = record.get(field)
+                if value is None or (low is not None and value < low) or (high is not None and value > high):
+                    return False
+            return True
+
+        if order_by in self._sorted:
+            low, high = ranges.get(order_by, (None, None))
+            result = []
+            for record_id in self._sorted[order_by].ids(low, high, descending):
+                record = self._records.get(record_id)
+                if record is not None and matches(record):
+                    result.append(record)
+                    if limit is not None and len(result) == limit:
+                        break
+            return result
+
+        candidates: Iterable[int] = list(self._records)
+        size = len(candidates)
+        for field, value in equals.items():
+            if field in self._indexes:
+                bucket = list(self._indexes[field].get(value, ()))
+                if len(bucket) < size:
+                    candidates, size = bucket, len(bucket)
+        for field, (low, high) in ranges.items():
+            if field in self._sorted:
+                start, stop = self._sorted[field].span(low, high)
+                if stop - start < size:
+                    candidates, size = self._sorted[field].ids(low, high), stop - start
+        result = [record for record in map(self._records.get, candidates) if record is not None and matches(record)]
+        result.sort(key=lambda r: r.get(order_by), reverse=descending)
+        return result if limit is None else result[:limit]
+
+    def search(self, text: str, limit: int) -> List[dict]:
+        """Return up to ``limit`` records matching ``text``, best match first."""
+        if self.text_index is None:
+            raise ValueError("This store has no text index")
+        result = []
+        for record_id, _ in self.text_index.search(text, limit):
+            record = self._records.get(record_id)
+            if record is not None:
+                result.append(record)
+        return result
+
+    def record_version(self, record_id: int) -> int:
+        return self._changes.get(record_id, self.horizon)
+
+    def changes_since(self, version: int, until: Optional[int] = None) -> Tuple[List[dict], List[int]]:
+        """
+        Return the records created or updated and the ids deleted after
+        ``version``, oldest change first. Raises ``ValueError`` if the change
+        log no longer reaches back to ``version``. Changes made after
+        ``until`` (a snapshot's version) are left for the next call.
+        """
+        entries = self.change_log(version, until)
+        return ([record for _, _, record in entries if record is not None],
+                [record_id for _, record_id, record in entries if record is None])
+
+    def change_log(self, version: int, until: Optional[int] = None) -> List[Tuple[int, int, Optional[dict]]]:
+        """
+        Return ``(changed_at, id, record)`` for every record changed after
+        ``version`` and no later than ``until``, oldest change first, with
+        ``record`` None for a delete. Raises ``ValueError`` like ``changes_since``.
+        """
+        if version < self.horizon or version > self.version:
+            raise ValueError(f"Version {version} is outside the change log")
+        entries: List[Tuple[int, int, Optional[dict]]] = []
+        for record_id, changed_at in reversed(self._changes.items()):
+            if changed_at <= version:
+                break
+            if until is not None and changed_at > until:
+                continue
+            entries.append((changed_at, record_id, self._records.get(record_id)))
+        entries.reverse()
+        return entries
+
+    def page(self, after: Optional[int], limit: int) -> Tuple[List[dict], Optional[int]]:
+        """
+        Return up to ``limit`` records with ids greater than ``after`` in id
+        order, plus the cursor for the next page (``None`` on the last page).
+        """
+        ids = self._ids
+        position = 0 if after is None else bisect_right(ids, after)
+        page: List[dict] = []
+        while position < len(ids):
+            record = self._records.get(ids[position])
+            position += 1
+            if record is None:
+                continue
+            if len(page) == limit:
+                return page, page[-1]["id"]
+            page.append(record)
+        return page, None
+
+    def insert(self, record: dict) -> dict:
+        record["id"] = self._next_id
+        self._next_id += 1
+        self._records[record["id"]] = record
+        self._ids.append(record["id"])
+        self._index(record)
+        self._touch(record["id"])
+        return record
+
+    def update(self, record_id: int, changes: dict) -> Optional[dict]:
+        record = self._records.get(record_id)
+        if record is None:
+            return None
+        self._unindex(record)
+        record = {**record, **changes}
+        self._records[record_id] = record
+        self._index(record)
+        self._touch(record_id)
+        return record
+
+    def delete(self, record_id: int) -> Optional[dict]:
+        record = self._records.pop(record_id, None)
+        if record is not None:
+            self._unindex(record)
+            self._touch(record_id)
+            self._deleted += 1
+            self._tombstones += 1
+            if self._tombstones > len(self._records):
+                self._ids = array("q", (i for i in self._ids if i in self._records))
+                self._tombstones = 0
+            if self._deleted > max(1024, len(self._records)):
+                self._forget_deletes()
+        return record
+
+    def _touch(self, record_id: int):
+        self.version += 1
+        self._changes[record_id] = self.version
+        self._changes.move_to_end(record_id)
+
+    def _forget_deletes(self):
+        # Drop the oldest half of the change log's deletes, along with any
+        # updates interleaved with them, and move the horizon past them.
+        target = self._deleted // 2
+        while self._deleted > target:
+            record_id, changed_at = self._changes.popitem(last=False)
+            if record_id not in self._records:
+                self._deleted -= 1
+            self.horizon = changed_at
+
+    def _index(self, record: dict):
+        for field, index in self._indexes.items():
+            index.setdefault(record.get(field), set()).add(record["id"])
+        for field, index in self._sorted.items():
+            index.add(record.get(field), record["id"])
+        for aggregate in self.aggregates.values():
+            aggregate.add(record)
+        if self.text_index is not None:
+            self.text_index.add(record)
+
+    def _unindex(self, record: dict):
+        if self.text_index is not None:
+            self.text_index.remove(record)
+        for aggregate in self.aggregates.values():
+            aggregate.remove(record)
+        for field, index in self._sorted.items():
+            index.remove(record.get(field), record["id"])
+        for field, index in self._indexes.items():
+            bucket = index.get(record.get(field))
+            if bucket is not None:
+                bucket.discard(record["id"])
+                if not bucket:
+                    del index[record.get(field)]
@@ -0,0 +1,48 @@
+import pytest
+
+ENGINES = ["dict", "sqlite"]
+EMPLOYEE = {"first_name": "David", "last_name": "Lee", "role": "Analyst", "department": "Finance", "salary": 70000}
+
+
+@pytest.mark.parametrize("engine", ENGINES)
+def test_crud_and_conditional_get(start, engine):
+    main, client = start(EMPLOYEES_STORAGE=engine)
+    created = client.post("/employees", json=EMPLOYEE).json()
+    assert created == {"id": 4, **EMPLOYEE}
+    response = client.get("/employees/4")
+    assert response.json() == created
+    etag = response.headers["ETag"]
+    assert client.get("/employees/4", headers={"If-None-Match": etag}).status_code == 304
+    client.put("/employees/4", json={"salary": 75000})
+    assert client.get("/employees/4", headers={"If-None-Match": etag}).json()["salary"] == 75000
+    assert client.delete("/employees/4").status_code == 200
+    assert client.get("/employees/4").status_code == 404
+
+
+@pytest.mark.parametrize("engine", ENGINES)
+def test_pagination_multi_get_and_order(start, engine):
+    main, client = start(EMPLOYEES_STORAGE=engine)
+    for number in range(4):
+        client.post("/employees", json={**EMPLOYEE, "salary": 50000 + number})
+    first = client.get("/employees", params={"limit": 5})
+    second = client.get("/employees", params={"limit": 5, "cursor": first.headers["X-Next-Cursor"]})
+    assert [e["id"] for e in first.json() + second.json()] == list(range(1, 8))
+    assert "X-Next-Cursor" not in second.headers
+    body = client.get("/employees", params={"ids": "3,42,1", "fields": "id"}).json()
+    assert body == {"employees": [{"id": 3}, {"id": 1}], "missing": [42]}
+    lowest = client.get("/employees", params={"order_by": "salary", "limit": 2, "fields": "salary"}).json()
+    assert lowest == [{"salary": 50000}, {"salary": 50001}]
+
+
+@pytest.mark.parametrize("engine", ENGINES)
+def test_batch_with_a_missing_id_applies_nothing(start, engine):
+    main, client = start(EMPLOYEES_STORAGE=engine)
+    before = client.get("/employees")
+    response = client.post("/employees:batch", json=[
+        {"op": "create", "employee": EMPLOYEE},
+        {"op": "delete", "id": 42},
+    ])
+    assert response.status_code == 409
+    assert [result["status"] for result in response.json()["results"]] == [424, 404]
+    after = client.get("/employees")
+    assert (after.json(), after.headers["ETag"]) == (before.json(), before.headers["ETag"])
@@ -0,0 +1,49 @@
+import threading
+
+BATCH_SIZE = 3000
+
+
+def test_reads_see_all_or_none_of_a_batch(start):
+    main, client = start(EMPLOYEES_PERSISTENCE="journal")
+    before = client.get("/employees")
+    operations = [{"op": "create", "employee": {"first_name": f"First {i}", "last_name": "Last", "role": "Analyst",
+                                                "department": "Bulk", "salary": 1000 + i}}
+                  for i in range(BATCH_SIZE)]
+    done = threading.Event()
+    seen = []
+
+    def read():
+        while not done.is_set():
+            response = client.get("/employees")
+            seen.append((response.headers["ETag"], len(response.json())))
+            _, records = main.mutations.read(lambda snapshot: main.employees.all())
+            seen.append((None, len(records)))
+
+    readers = [threading.Thread(target=read) for _ in range(2)]
+    for reader in readers:
+        reader.start()
+    try:
+        assert client.post("/employees:batch", json=operations).status_code == 200
+    finally:
+        done.set()
+        for reader in readers:
+            reader.join()
+    after = client.get("/employees")
+    states = {before.headers["ETag"]: len(before.json()), after.headers["ETag"]: len(after.json())}
+    assert set(states.values()) == {3, 3 + BATCH_SIZE}
+    for etag, count in seen:
+        assert count in states.values()
+        if etag is not None:
+            assert states[etag] == count
+
+
+def test_record_etag_matches_its_body(start):
+    _, client = start()
+    response = client.get("/employees/1")
+    etag = response.headers["ETag"]
+    assert client.get("/employees/1", headers={"If-None-Match": etag}).status_code == 304
+    client.put("/employees/1", json={"salary": 1})
+    response = client.get("/employees/1", headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.json()["salary"] == 1
+    assert response.headers["ETag"] != etag
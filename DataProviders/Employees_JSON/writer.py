@@ -0,0 +1,168 @@
+from collections import deque
+from typing import Callable, Deque, List, Optional, Tuple, TypeVar
+import threading
+
+from store import StoreSnapshot
+
+T = TypeVar("T")
+
+
+class _Mutation:
+    """One submitted mutation and, once applied, its outcome."""
+
+    def __init__(self, apply: Callable[[], object]):
+        self.apply = apply
+        self.done = threading.Event()
+        self.result = None
+        self.error: Optional[BaseException] = None
+
+
+class MutationQueue:
+    """
+    Applies every mutation to a store on one writer thread, in the order the
+    mutations were submitted.
+
+    Request threads ``submit`` a function that changes the store (and does
+    whatever else must happen in mutation order, such as persisting and
+    publishing the change) and block until the writer has run it. They get
+    back its result or its exception. No lock is held while mutations run;
+    request threads only touch the queue itself. The writer takes whatever
+    is queued, up to ``max_group`` mutations, and applies them back to back.
+    Then it publishes a new ``StoreSnapshot`` and only after that wakes the
+    submitters, so a client always reads its own writes.
+
+    Readers take no lock while they read. The records themselves live in the
+    store, which the writer changes in place, so ``read`` guards them with a
+    sequence number that the writer makes odd while it applies a group and
+    even again once the group's snapshot is published. A read waits until
+    the number is even, runs the function against the published snapshot,
+    and keeps the result only if the number has not moved meanwhile.
+    Otherwise it retries, whatever the function returned or raised, and
+    after ``read_attempts`` tries it runs on the writer thread between two
+    mutations. A read therefore sees either all of a group, and so all of a
+    batch, or none of it.
+
+    A ``shared`` store is also written by other processes, so there is no
+    single writer to publish its snapshots. There ``read`` runs the function
+    and takes the snapshot in one database read transaction, which isolates
+    it just as well.
+    """
+
+    def __init__(self, store, max_group: int = 256, read_attempts: int = 3, shared: bool = False):
+        self.store = store
+        self.max_group = max_group
+        self.read_attempts = read_attempts
+        self.shared = shared
+        self._snapshot: Optional[StoreSnapshot] = None
+        self._sequence = 0
+        self._cond = threading.Condition()
+        self._queue: Deque[_Mutation] = deque()
+        self._closed = False
+        self._writer: Optional[threading.Thread] = None
+        self._counters = {"mutations": 0, "groups": 0, "max_group_size": 0, "read_retries": 0, "read_fallbacks": 0}
+
+    def start(self):
+        self._snapshot = self.store.snapshot()
+        self._writer = threading.Thread(target=self._write_loop, name="mutation-writer", daemon=True)
+        self._writer.start()
+
+    @property
+    def snapshot(self) -> StoreSnapshot:
+        """The state readers answer from: the last one published."""
+        if self.shared:
+            return self.store.snapshot()
+        return self._snapshot
+
+    def submit(self, apply: Callable[[], T]) -> T:
+        mutation = _Mutation(apply)
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("The mutation queue is closed")
+            self._queue.append(mutation)
+            self._cond.notify()
+        mutation.done.wait()
+        if mutation.error is not None:
+            raise mutation.error
+        return mutation.result
+
+    def read(self, fn: Callable[[StoreSnapshot], T]) -> Tuple[StoreSnapshot, T]:
+        """Run ``fn(snapshot)`` without blocking writers; return both."""
+        if self.shared:
+            with self.store.transaction(write=False):
+                snapshot = self.store.snapshot()
+                return snapshot, fn(snapshot)
+        if threading.current_thread() is self._writer:
+            # Called from a mutation: nothing else is writing.
+            snapshot = self.store.snapshot()
+            return snapshot, fn(snapshot)
+        for _ in range(self.read_attempts):
+            with self._cond:
+                while self._sequence % 2:
+                    self._cond.wait()
+                sequence, snapshot = self._sequence, self._snapshot
+            try:
+                result = fn(snapshot)
+            except Exception:
+                # A read torn by a concurrent group can fail in any way.
+                if self._sequence == sequence:
+                    raise
+            else:
+                if self._sequence == sequence:
+                    return snapshot, result
+            self._count("read_retries")
+        self._count("read_fallbacks")
+
+        def read_between_mutations():
+            snapshot = self.store.snapshot()
+            return snapshot, fn(snapshot)
+        return self.submit(read_between_mutations)
+
+    def metrics(self) -> dict:
+        with self._cond:
+            queued = len(self._queue)
+            counters = dict(self._counters)
+        return {
+            "queued": queued,
+            **counters,
+            "avg_group_size": counters["mutations"] / counters["groups"] if counters["groups"] else 0,
+        }
+
+    def _write_loop(self):
+        while True:
+            with self._cond:
+                while not self._queue and not self._closed:
+                    self._cond.wait()
+                if not self._queue:
+                    return
+                group: List[_Mutation] = [self._queue.popleft() for _ in range(min(len(self._queue), self.max_group))]
+                self._sequence += 1
+            for mutation in group:
+                try:
+                    mutation.result = mutation.apply()
+                except Exception as e:
+                    mutation.error = e
+            if not self.shared:
+                try:
+                    self._snapshot = self.store.snapshot()
+                except Exception as e:
+                    print(f"Error publishing a snapshot after {len(group)} mutations: {e}")
+            with self._cond:
+                self._sequence += 1
+                self._cond.notify_all()
+                self._counters["mutations"] += len(group)
+                self._counters["groups"] += 1
+                self._counters["max_group_size"] = max(self._counters["max_group_size"], len(group))
+            for mutation in group:
+                mutation.done.set()
+
+    def _count(self, counter: str):
+        with self._cond:
+            self._counters[counter] += 1
+
+    def close(self):
+        """Apply what is already queued, then stop the writer."""
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+        if self._writer is not None:
+            self._writer.join()
@@ -0,0 +1,252 @@
+from array import array
+from bisect import bisect_left
+from collections.abc import MutableMapping
+from typing import Dict, Iterator, List, Optional, Tuple
+import time
+
+FIELDS = ("id", "name", "category", "quantity", "price")
+
+
+class StringDictionary:
+    """Each distinct string stored once; rows hold its integer code."""
+
+    def __init__(self):
+        self.values: List[str] = []
+        self._codes: Dict[str, int] = {}
+
+    def encode(self, value: str) -> int:
+        code = self._codes.get(value)
+        if code is None:
+            code = self._codes[value] = len(self.values)
+            self.values.append(value)
+        return code
+
+
+class _Columns:
+    # Grouped so that compaction can swap every column in one assignment.
+    def __init__(self):
+        self.live = bytearray()
+        self.name_start = array("Q")
+        self.name_length = array("I")
+        self.category = array("I")
+        self.quantity = array("q")
+        self.price = array("d")
+        self.ids = array("q")
+        self.names = bytearray()
+
+
+class ColumnarTable(MutableMapping):
+    """
+    Inventory records packed into typed columns, usable as the record table
+    of a ``RecordStore``.
+
+    ``id`` and ``quantity`` are 64-bit integer arrays and ``price`` is a
+    double array. ``category`` is dictionary-encoded, so each row holds a
+    4-byte code. Names are UTF-8 in one shared byte string, and each row
+    holds an offset and length into it. A row costs about 40 bytes plus its
+    name, where a dict costs several hundred.
+
+    Rows are kept in ascending id order and found by binary search on the
+    ``id`` column. The store allocates ids monotonically, so inserts append.
+    Deleted rows are flagged dead and dropped by compaction once they
+    outnumber the live ones, or once names overwritten by updates take up
+    half of the name bytes.
+
+    Lookups return a fresh dict built from the columns. Changing that dict
+    does not change the table; write it back with ``table[id] = record``.
+    ``column`` exposes the raw arrays for scans. They support the buffer
+    protocol, e.g. ``numpy.frombuffer(table.column("price"))``, and
+    ``live()`` masks out dead rows.
+
+    Updates rewrite a row in place while other threads may be reading it.
+    ``_rewrites`` is odd while a row is being rewritten, and a reader that
+    saw it change while copying a row copies the row again, so no reader
+    gets half of an update.
+    """
+
+    def __init__(self, compact_min_rows: int = 1024):
+        self.compact_min_rows = compact_min_rows
+        self.categories = StringDictionary()
+        self._columns = _Columns()
+        self._rows = 0
+        self._dead = 0
+        self._garbage = 0
+        self._rewrites = 0
+
+    # ---------------- Mapping ----------------
+    def __len__(self) -> int:
+        return self._rows
+
+    def __iter__(self) -> Iterator[int]:
+        columns = self._columns
+        live, ids = columns.live, columns.ids
+        for row in range(len(ids)):
+            if live[row]:
+                yield ids[row]
+
+    def __contains__(self, record_id) -> bool:
+        return self._find(self._columns, record_id) is not None
+
+    def __getitem__(self, record_id: int) -> dict:
+        columns = self._columns
+        row = self._find(columns, record_id)
+        if row is None:
+            raise KeyError(record_id)
+        return self._materialize(columns, row)
+
+    def get(self, record_id: int, default=None):
+        columns = self._columns
+        row = self._find(columns, record_id)
+        return default if row is None else self._materialize(columns, row)
+
+    def values(self) -> Iterator[dict]:
+        columns = self._columns
+        live = columns.live
+        for row in range(len(columns.ids)):
+            if live[row]:
+                yield self._materialize(columns, row)
+
+    def items(self) -> Iterator[Tuple[int, dict]]:
+        for record in self.values():
+            yield record["id"], record
+
+    def __setitem__(self, record_id: int, record: dict):
+        if record.keys() != set(FIELDS) or record["id"] != record_id:
+            raise ValueError(f"Record {record_id} does not match the columnar schema {FIELDS}: {sorted(record)}")
+        try:
+            name = record["name"].encode("utf-8")
+            category = self.categories.encode(record["category"])
+            quantity, price = int(record["quantity"]), float(record["price"])
+        except (AttributeError, TypeError, ValueError) as e:
+            raise ValueError(f"Record {record_id} cannot be stored in columnar form: {e}") from None
+        columns = self._columns
+        position = bisect_left(columns.ids, record_id)
+        if position < len(columns.ids) and columns.ids[position] == record_id:
+            start = len(columns.names)
+            columns.names += name
+            self._rewrites += 1
+            if columns.live[position]:
+                self._garbage += columns.name_length[position]
+            else:
+                columns.live[position] = 1
+                self._dead -= 1
+                self._rows += 1
+            columns.name_start[position] = start
+            columns.name_length[position] = len(name)
+            columns.category[position] = category
+            columns.quantity[position] = quantity
+            columns.price[position] = price
+            self._rewrites += 1
+            if self._garbage > max(1 << 20, len(columns.names) // 2):
+                self.compact()
+            return
+        values = (1, len(columns.names), len(name), category, quantity, price, record_id)
+        if position == len(columns.ids):
+            # The common case: ids only grow. ``ids`` is appended last so
+            # that a concurrent lookup never finds a row that is half written.
+            for column, value in zip(self._column_list(columns), values):
+                column.append(value)
+        else:
+            # Out-of-order ids only occur while loading a hand-edited file.
+            for column, value in zip(self._column_list(columns), values):
+                column.insert(position, value)
+        columns.names += name
+        self._rows += 1
+
+    def __delitem__(self, record_id: int):
+        columns = self._columns
+        row = self._find(columns, record_id)
+        if row is None:
+            raise KeyError(record_id)
+        columns.live[row] = 0
+        self._rows -= 1
+        self._dead += 1
+        self._garbage += columns.name_length[row]
+        if self._dead > max(self.compact_min_rows, self._rows):
+            self.compact()
+
+    def pop(self, record_id: int, *default):
+        columns = self._columns
+        row = self._find(columns, record_id)
+        if row is None:
+            if default:
+                return default[0]
+            raise KeyError(record_id)
+        record = self._materialize(columns, row)
+        del self[record_id]
+        return record
+
+    # ---------------- Columns ----------------
+    def column(self, field: str):
+        """Return the raw array behind ``field`` (category codes for ``category``)."""
+        if field not in FIELDS or field == "name":
+            raise ValueError(f"No typed column for field: {field!r}")
+        return getattr(self._columns, field if field != "id" else "ids")
+
+    def live(self) -> bytearray:
+        """One byte per row, 1 for live rows and 0 for deleted ones."""
+        return self._columns.live
+
+    def compact(self):
+        """Rewrite the columns without dead rows or overwritten names."""
+        old = self._columns
+        new = _Columns()
+        for row in range(len(old.ids)):
+            if not old.live[row]:
+                continue
+            start, length = old.name_start[row], old.name_length[row]
+            values = (1, len(new.names), length, old.category[row], old.quantity[row], old.price[row], old.ids[row])
+            for column, value in zip(self._column_list(new), values):
+                column.append(value)
+            new.names += old.names[start:start + length]
+        self._columns = new
+        self._dead = 0
+        self._garbage = 0
+
+    def metrics(self) -> dict:
+        columns = self._columns
+        arrays = self._column_list(columns)[1:]
+        return {
+            "engine": "columnar",
+            "rows": self._rows,
+            "dead_rows": self._dead,
+            "categories": len(self.categories.values),
+            "name_bytes": len(columns.names),
+            "garbage_name_bytes": self._garbage,
+            "bytes": len(columns.live) + len(columns.names) + sum(a.itemsize * len(a) for a in arrays),
+        }
+
+    # ---------------- Internals ----------------
+    @staticmethod
+    def _column_list(columns: _Columns) -> tuple:
+        return (columns.live, columns.name_start, columns.name_length, columns.category,
+                columns.quantity, columns.price, columns.ids)
+
+    @staticmethod
+    def _find(columns: _Columns, record_id) -> Optional[int]:
+        if not isinstance(record_id, int):
+            return None
+        ids = columns.ids
+        row = bisect_left(ids, record_id)
+        if row < len(ids) and ids[row] == record_id and columns.live[row]:
+            return row
+        return None
+
+    def _materialize(self, columns: _Columns, row: int) -> dict:
+        while True:
+            rewrites = self._rewrites
+            if rewrites % 2:
+                time.sleep(0)  # Let the writer finish the row.
+                continue
+            start = columns.name_start[row]
+            name = columns.names[start:start + columns.name_length[row]]
+            category, quantity, price = columns.category[row], columns.quantity[row], columns.price[row]
+            if rewrites == self._rewrites:
+                break
+        return {
+            "id": columns.ids[row],
+            "name": name.decode("utf-8"),
+            "category": self.categories.values[category],
+            "quantity": quantity,
+            "price": price,
+        }
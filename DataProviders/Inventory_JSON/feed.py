@@ -0,0 +1,103 @@
+from typing import AsyncIterator, List, Set, Tuple
+import asyncio
+import json
+import threading
+
+DROPPED = object()
+
+
+def format_event(version: int, event: str, data) -> str:
+    """Encode one Server-Sent Event whose id is the collection version."""
+    return f"id: {version}\nevent: {event}\ndata: {json.dumps(data, separators=(',', ':'))}\n\n"
+
+
+class Subscriber:
+    def __init__(self, loop: asyncio.AbstractEventLoop, buffer_size: int):
+        self.loop = loop
+        self.queue: asyncio.Queue = asyncio.Queue(buffer_size)
+        self.dropped = False
+
+
+class ChangeFeed:
+    """
+    Fan-out of mutation events to Server-Sent Events subscribers.
+
+    ``publish`` is called by the (threaded) mutation handlers and never
+    blocks: each event is formatted once and handed to every subscriber's
+    event loop with ``call_soon_threadsafe``. Every subscriber has a bounded
+    buffer; one that falls ``buffer_size`` events behind is dropped and told
+    so, and can reconnect with ``Last-Event-ID`` to resume from the change log.
+    """
+
+    def __init__(self, buffer_size: int = 1000, heartbeat: float = 15.0):
+        self.buffer_size = buffer_size
+        self.heartbeat = heartbeat
+        self._lock = threading.Lock()
+        self._subscribers: Set[Subscriber] = set()
+        self.published = 0
+        self.dropped = 0
+
+    def subscribe(self) -> Subscriber:
+        subscriber = Subscriber(asyncio.get_running_loop(), self.buffer_size)
+        with self._lock:
+            self._subscribers.add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber: Subscriber):
+        with self._lock:
+            self._subscribers.discard(subscriber)
+
+    def publish(self, version: int, event: str, data):
+        with self._lock:
+            subscribers = list(self._subscribers)
+            self.published += 1
+        if not subscribers:
+            return
+        message = format_event(version, event, data)
+        for subscriber in subscribers:
+            try:
+                subscriber.loop.call_soon_threadsafe(self._offer, subscriber, version, message)
+            except RuntimeError:
+                # The subscriber's event loop has shut down.
+                self.unsubscribe(subscriber)
+
+    def _offer(self, subscriber: Subscriber, version: int, message: str):
+        if subscriber.dropped:
+            return
+        try:
+            subscriber.queue.put_nowait((version, message))
+        except asyncio.QueueFull:
+            subscriber.dropped = True
+            self.unsubscribe(subscriber)
+            with self._lock:
+                self.dropped += 1
+            while not subscriber.queue.empty():
+                subscriber.queue.get_nowait()
+            subscriber.queue.put_nowait(DROPPED)
+
+    async def stream(self, subscriber: Subscriber, backlog: List[Tuple[int, str]], after: int) -> AsyncIterator[str]:
+        """
+        Yield the replayed ``backlog`` and then live events newer than
+        ``after``, with a comment line every ``heartbeat`` seconds of silence.
+        """
+        try:
+            for _, message in backlog:
+                yield message
+            while True:
+                try:
+                    item = await asyncio.wait_for(subscriber.queue.get(), self.heartbeat)
+                except asyncio.TimeoutError:
+                    yield ": keep-alive\n\n"
+                    continue
+                if item is DROPPED:
+                    yield "event: dropped\ndata: {}\n\n"
+                    return
+                version, message = item
+                if version > after:
+                    yield message
+        finally:
+            self.unsubscribe(subscriber)
+
+    def metrics(self) -> dict:
+        with self._lock:
+            return {"subscribers": len(self._subscribers), "published": self.published, "dropped": self.dropped}
@@ -1,25 +1,172 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, Header, HTTPException, Query, Request, Response
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import JSONResponse, StreamingResponse
 from pydantic import BaseModel, Field
-from typing import List
-import json
+from typing import Annotated, List, Literal, Union
 import os
+import threading
+
+from cache import ResponseCache
+from columnar import ColumnarTable
+from export import FORMATS, export_chunks
+from feed import ChangeFeed, format_event
+from persistence import DatabasePersistence, LoadProgress, open_persistence
+from search import TextIndex
+from sqlite_store import SQLiteStore
+from store import GroupAggregate, RecordStore, paginate
+from writer import MutationQueue
 
 app = FastAPI(title="Inventory Data Provider")
 
 DATA_FILE = os.path.join("data", "inventory.json")
+JOURNAL_FILE = os.path.join("data", "inventory.journal")
+DB_FILE = os.path.join("data", "inventory.db")
 
 # ---------------- Data Persistence ----------------
-def load_data() -> List[dict]:
-    if not os.path.exists(DATA_FILE):
-        return []
-    with open(DATA_FILE, "r") as f:
-        return json.load(f)
+# "file" rewrites DATA_FILE on every mutation; "journal" appends each mutation
+# to JOURNAL_FILE and folds it into DATA_FILE in the background.
+PERSISTENCE_MODE = os.environ.get("INVENTORY_PERSISTENCE", "file")
+COMPACT_INTERVAL = float(os.environ.get("INVENTORY_COMPACT_INTERVAL", "60"))
+# "sync" writes each mutation before responding; "group" hands mutations to a
+# writer thread that flushes them in batches (pass ?durable=true to wait).
+DURABILITY = os.environ.get("INVENTORY_DURABILITY", "sync")
+GROUP_COMMIT_WINDOW_MS = float(os.environ.get("INVENTORY_GROUP_COMMIT_WINDOW_MS", "50"))
+GROUP_COMMIT_MAX_BATCH = int(os.environ.get("INVENTORY_GROUP_COMMIT_MAX_BATCH", "1000"))
+
+# ---------------- Storage Engine ----------------
+# "dict" keeps every item as a Python dict; "columnar" packs items into typed
+# arrays and builds dicts only when they are serialized, for collections too
+# large to hold as dicts. Both live in the process, persisted as configured
+# above. "sqlite" keeps the items in DB_FILE, an SQLite database in WAL mode
+# that several worker processes (uvicorn --workers N) share; DATA_FILE then
+# only seeds an empty database.
+STORAGE_ENGINE = os.environ.get("INVENTORY_STORAGE", "dict")
+SHARED_STORE = STORAGE_ENGINE == "sqlite"
+
+category_totals = GroupAggregate("category", {
+    "quantity": lambda r: r["quantity"],
+    "value": lambda r: r["quantity"] * r["price"],
+})
+
+if STORAGE_ENGINE in ("dict", "columnar"):
+    persistence = open_persistence(PERSISTENCE_MODE, DATA_FILE, JOURNAL_FILE, COMPACT_INTERVAL,
+                                   DURABILITY, GROUP_COMMIT_WINDOW_MS / 1000, GROUP_COMMIT_MAX_BATCH)
+    inventory = RecordStore(first_id=101, indexed_fields=("category",),
+                            range_fields=("quantity", "price"),
+                            aggregates={"category": category_totals},
+                            text_index=TextIndex(("name",)),
+                            table=ColumnarTable() if STORAGE_ENGINE == "columnar" else None)
+elif STORAGE_ENGINE == "sqlite":
+    persistence = DatabasePersistence(DATA_FILE)
+    inventory = SQLiteStore(DB_FILE, first_id=101, indexed_fields=("category",),
+                            range_fields=("quantity", "price"),
+                            aggregates={"category": category_totals},
+                            text_fields=("name",))
+else:
+    raise ValueError(f"Unknown storage engine: {STORAGE_ENGINE!r} (expected 'dict', 'columnar' or 'sqlite')")
+
+# ---------------- Writer ----------------
+# Every mutation is applied in order by one writer thread, which publishes a
+# snapshot after each group of them; readers answer from that snapshot
+# without taking a lock, retrying any read that overlaps a group.
+MAX_MUTATION_GROUP = int(os.environ.get("INVENTORY_MAX_MUTATION_GROUP", "256"))
+
+mutations = MutationQueue(inventory, MAX_MUTATION_GROUP, shared=SHARED_STORE)
+
+# The data is streamed in on a background thread so the service is reachable
+# (and /ready reports progress) while a large file is still loading; every
+# other endpoint answers 503 until loading completes.
+load_progress = LoadProgress()
+
+def load_inventory():
+    try:
+        inventory.load(persistence.load(load_progress), load_progress)
+        persistence.start(inventory.all)
+        mutations.start()
+    except Exception as e:
+        print(f"Error loading inventory: {e}")
+        load_progress.finish(error=str(e))
+        return
+    load_progress.finish()
+
+threading.Thread(target=load_inventory, name="inventory-loader", daemon=True).start()
+
+READY_EXEMPT_PATHS = ("/ready", "/metrics", "/docs", "/redoc", "/openapi.json")
+
+@app.middleware("http")
+async def require_loaded(request: Request, call_next):
+    if not load_progress.done and request.url.path not in READY_EXEMPT_PATHS:
+        return JSONResponse({"detail": "Inventory data is still loading", **load_progress.as_dict()},
+                            status_code=503, headers={"Retry-After": "1"})
+    return await call_next(request)
 
-def save_data(data: List[dict]):
-    with open(DATA_FILE, "w") as f:
-        json.dump(data, f, indent=4)
+@app.get("/ready")
+def get_ready():
+    return JSONResponse(load_progress.as_dict(), status_code=200 if load_progress.done else 503)
 
-inventory = load_data()
+# ---------------- Response Cache ----------------
+RESPONSE_CACHE_RECORDS = int(os.environ.get("INVENTORY_RESPONSE_CACHE_RECORDS", "10000"))
+RESPONSE_CACHE_GZIP = os.environ.get("INVENTORY_RESPONSE_CACHE_GZIP", "true").lower() == "true"
+
+response_cache = ResponseCache(RESPONSE_CACHE_RECORDS, RESPONSE_CACHE_GZIP)
+
+# ---------------- Change Feed ----------------
+STREAM_BUFFER_SIZE = int(os.environ.get("INVENTORY_STREAM_BUFFER_SIZE", "1000"))
+# How often each worker polls a shared store's change log for the feed.
+STREAM_POLL_MS = float(os.environ.get("INVENTORY_STREAM_POLL_MS", "200"))
+
+change_feed = ChangeFeed(STREAM_BUFFER_SIZE)
+
+def notify(event: str, data):
+    # A shared store is also changed by other processes, so there the feed is
+    # fed by follow_changes instead of by the handlers.
+    if not SHARED_STORE:
+        change_feed.publish(inventory.version, event, data)
+
+def collect_changes(since: int):
+    # Reads the change log up to the published snapshot and returns the
+    # events after `since`, oldest first, and the version they bring a client to.
+    # Each event carries the version logged with its change, which is never
+    # above the snapshot's, so the live feed does not send it again.
+    snapshot, entries = mutations.read(lambda snapshot: inventory.change_log(since, snapshot.version))
+    events = [(changed_at, "upsert", dict(record)) if record is not None else (changed_at, "delete", {"id": record_id})
+              for changed_at, record_id, record in entries]
+    return events, snapshot.version
+
+def replay_changes(since: int):
+    events, version = collect_changes(since)
+    return [(v, format_event(v, event, data)) for v, event, data in events], version
+
+feed_stopped = threading.Event()
+
+def follow_changes():
+    load_progress.wait()
+    after = mutations.snapshot.version
+    while not feed_stopped.wait(STREAM_POLL_MS / 1000):
+        try:
+            if mutations.snapshot.version == after:
+                continue
+            events, after = collect_changes(after)
+        except ValueError:
+            # The change log was trimmed past our position; skip ahead.
+            after = mutations.snapshot.version
+            continue
+        except Exception as e:
+            print(f"Error following inventory changes: {e}")
+            continue
+        for version, event, data in events:
+            change_feed.publish(version, event, data)
+
+if SHARED_STORE:
+    threading.Thread(target=follow_changes, name="inventory-feed", daemon=True).start()
+
+@app.on_event("shutdown")
+def close_persistence():
+    mutations.close()
+    persistence.close()
+    if SHARED_STORE:
+        feed_stopped.set()
+        inventory.close()
 
 # ---------------- Pydantic Models ----------------
 class InventoryItem(BaseModel):
@@ -34,41 +181,335 @@ class InventoryItemUpdate(BaseModel):
     quantity: int | None = Field(None, ge=0)
     price: float | None = Field(None, gt=0)
 
+# ---------------- Query Helpers ----------------
+FIELDS = ("id", "name", "category", "quantity", "price")
+ORDER_FIELDS = ("id", "quantity", "price")
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+DEFAULT_SEARCH_LIMIT = 20
+MAX_SEARCH_LIMIT = 100
+MAX_IDS = 1000
+EXPORT_CHUNK_SIZE = int(os.environ.get("INVENTORY_EXPORT_CHUNK_SIZE", "1000"))
+
+def parse_fields(fields: str | None) -> List[str] | None:
+    if fields is None:
+        return None
+    columns = [f.strip() for f in fields.split(",") if f.strip()]
+    unknown = [f for f in columns if f not in FIELDS]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown fields: {', '.join(unknown)}")
+    return columns
+
+def parse_ids(ids: str) -> List[int]:
+    try:
+        values = [int(i) for i in ids.split(",") if i.strip()]
+    except ValueError:
+        raise HTTPException(status_code=400, detail="ids must be a comma-separated list of integers")
+    if len(values) > MAX_IDS:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_IDS} ids can be requested at once")
+    return values
+
+def parse_order(order_by: str | None):
+    if order_by is None:
+        return "id", False
+    field = order_by.lstrip("-")
+    if field not in ORDER_FIELDS:
+        raise HTTPException(status_code=400, detail=f"Cannot order by {field}; expected one of {', '.join(ORDER_FIELDS)}")
+    return field, order_by.startswith("-")
+
+def version_headers(version: int) -> dict:
+    # The ETag is weak because the gzip and identity encodings of a body share
+    # it; Vary tells caches the two are stored apart.
+    return {"ETag": f'W/"{version}"', "Vary": "Accept-Encoding"}
+
+def etag_matches(if_none_match: str | None, version: int) -> bool:
+    if if_none_match is None:
+        return False
+    candidates = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+    return "*" in candidates or f'"{version}"' in candidates
+
+def read_page(after: int | None, limit: int):
+    # One export chunk, read from a single snapshot like any other read.
+    _, page = mutations.read(lambda snapshot: inventory.page(after, limit))
+    return page
+
+def project(records: List[dict], columns: List[str] | None) -> List[dict]:
+    if columns is None:
+        return records
+    return [{c: r[c] for c in columns} for r in records]
+
 # ---------------- CRUD ----------------
 @app.get("/inventory")
-def get_inventory():
-    return inventory
+def get_inventory(ids: str | None = None,
+                  limit: int | None = Query(None, ge=1, le=MAX_PAGE_SIZE),
+                  cursor: int | None = None,
+                  fields: str | None = None,
+                  category: str | None = None,
+                  min_quantity: int | None = None,
+                  max_quantity: int | None = None,
+                  min_price: float | None = None,
+                  max_price: float | None = None,
+                  order_by: str | None = None,
+                  if_none_match: str | None = Header(None),
+                  accept_encoding: str | None = Header(None)):
+    # Without parameters the whole collection is returned, as before. With
+    # limit/cursor, records come back in id order and X-Next-Cursor holds the
+    # cursor for the following page. Filters are answered from the secondary
+    # and range indexes; order_by=<field> or -<field> with a limit is a top-k
+    # query read straight from the sorted index. The ETag is the collection
+    # version, so polling clients get a 304 until something changes (once the
+    # parameters have been validated), and the plain full listing is served
+    # from the pre-serialized response cache.
+    # ids=<id>,<id>,... is a multi-get: the records found, in the order asked
+    # for, plus the ids that do not exist.
+    # The records are read inside mutations.read, which retries any read that
+    # overlaps a writer group, and the ETag is the version of the snapshot
+    # they were read under.
+    columns = parse_fields(fields)
+    order_field, descending = parse_order(order_by)
+    filters = {k: v for k, v in {"category": category}.items() if v is not None}
+    ranges = {k: v for k, v in {"quantity": (min_quantity, max_quantity), "price": (min_price, max_price)}.items() if v != (None, None)}
+    paginated = limit is not None or cursor is not None
+    if ids is not None:
+        if filters or ranges or paginated or order_by is not None:
+            raise HTTPException(status_code=400, detail="ids cannot be combined with filters, ordering or pagination")
+        requested = parse_ids(ids)
+    if (order_field != "id" or descending) and cursor is not None:
+        raise HTTPException(status_code=400, detail="cursor can only be used with id ordering")
+    version = mutations.snapshot.version
+    if etag_matches(if_none_match, version):
+        return Response(status_code=304, headers=version_headers(version))
+    if ids is not None:
+        snapshot, (found, missing) = mutations.read(lambda snapshot: inventory.get_many(requested))
+        return JSONResponse({"inventory": project(found, columns), "missing": missing},
+                            headers=version_headers(snapshot.version))
+    if columns is None and order_by is None and not filters and not ranges and not paginated:
+        snapshot, entry = mutations.read(lambda snapshot: response_cache.collection(snapshot.version, inventory.all))
+        return response_cache.respond(entry, accept_encoding, version_headers(snapshot.version))
+
+    def fetch(snapshot):
+        if order_field != "id" or descending:
+            return inventory.query(filters, ranges, order_field, descending, limit), None
+        if filters or ranges:
+            records = inventory.query(filters, ranges)
+            if paginated:
+                return paginate(records, cursor, limit or DEFAULT_PAGE_SIZE)
+            return records, None
+        if not paginated:
+            return inventory.all(), None
+        return inventory.page(cursor, limit or DEFAULT_PAGE_SIZE)
+
+    snapshot, (records, next_cursor) = mutations.read(fetch)
+    headers = version_headers(snapshot.version)
+    if next_cursor is not None:
+        headers["X-Next-Cursor"] = str(next_cursor)
+    return JSONResponse(project(records, columns), headers=headers)
+
+@app.get("/inventory/changes")
+def get_inventory_changes(since: int):
+    # Delta sync: pass the version from a previous ETag (or changes response)
+    # and get back only what was created, updated or deleted after it.
+    try:
+        snapshot, (upserted, deleted) = mutations.read(lambda snapshot: inventory.changes_since(since, snapshot.version))
+    except ValueError as e:
+        raise HTTPException(status_code=410, detail=f"{e}; fetch /inventory again")
+    return JSONResponse({"version": snapshot.version, "upserted": upserted, "deleted": deleted},
+                        headers={"ETag": f'"{snapshot.version}"'})
+
+@app.get("/inventory/stats")
+def get_inventory_stats():
+    # Served from running aggregates maintained by the store, so the cost does
+    # not depend on the number of items.
+    groups = mutations.snapshot.aggregates["category"]
+    by_category = {
+        category: {"items": g["count"], "quantity": g["quantity"], "value": round(g["value"], 2)}
+        for category, g in groups.items()
+    }
+    return {
+        "total": {
+            "items": sum(g["items"] for g in by_category.values()),
+            "quantity": sum(g["quantity"] for g in by_category.values()),
+            "value": round(sum(g["value"] for g in groups.values()), 2),
+        },
+        "by_category": by_category,
+    }
+
+@app.get("/inventory/search")
+def search_inventory(q: str = Query(..., min_length=1),
+                     limit: int = Query(DEFAULT_SEARCH_LIMIT, ge=1, le=MAX_SEARCH_LIMIT),
+                     fields: str | None = None):
+    # Typeahead search over item names. Every word of q has to match a word of
+    # the name exactly, as a prefix or, failing both, approximately; results
+    # are ranked by how well they match.
+    columns = parse_fields(fields)
+    _, records = mutations.read(lambda snapshot: inventory.search(q, limit))
+    return JSONResponse(project(records, columns))
+
+@app.get("/inventory/export")
+def export_inventory(format: Literal["ndjson", "csv"] = "ndjson",
+                     fields: str | None = None,
+                     accept_encoding: str | None = Header(None)):
+    # Full extract for analytics, streamed in id order one chunk of
+    # EXPORT_CHUNK_SIZE items at a time instead of as one JSON array, and
+    # gzipped on the fly when the client accepts it.
+    columns = parse_fields(fields) or list(FIELDS)
+    media_type, extension = FORMATS[format]
+    compress = accept_encoding is not None and "gzip" in accept_encoding
+    headers = {"Content-Disposition": f'attachment; filename="inventory.{extension}"', "Vary": "Accept-Encoding"}
+    if compress:
+        headers["Content-Encoding"] = "gzip"
+    return StreamingResponse(export_chunks(read_page, format, columns, EXPORT_CHUNK_SIZE, compress),
+                             media_type=media_type, headers=headers)
+
+@app.get("/inventory/stream")
+async def stream_inventory(since: int | None = None, last_event_id: str | None = Header(None)):
+    # Server-Sent Events: one "upsert" or "delete" event per mutation, with the
+    # collection version as the event id. Reconnecting with Last-Event-ID (or
+    # ?since=<version>) first replays what was missed from the change log.
+    if last_event_id is not None:
+        try:
+            since = int(last_event_id)
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Last-Event-ID must be a version number")
+    subscriber = change_feed.subscribe()
+    backlog, after = [], mutations.snapshot.version
+    if since is not None:
+        try:
+            backlog, after = await run_in_threadpool(replay_changes, since)
+        except ValueError as e:
+            change_feed.unsubscribe(subscriber)
+            raise HTTPException(status_code=410, detail=f"{e}; fetch /inventory again")
+    return StreamingResponse(change_feed.stream(subscriber, backlog, after),
+                             media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
 
 @app.get("/inventory/{item_id}")
-def get_item(item_id: int):
-    for item in inventory:
-        if item["id"] == item_id:
-            return item
-    raise HTTPException(status_code=404, detail="Item not found")
+def get_item(item_id: int, if_none_match: str | None = Header(None), accept_encoding: str | None = Header(None)):
+    _, (version, item) = mutations.read(lambda snapshot: (inventory.record_version(item_id), inventory.get(item_id)))
+    if item is None:
+        raise HTTPException(status_code=404, detail="Item not found")
+    if etag_matches(if_none_match, version):
+        return Response(status_code=304, headers=version_headers(version))
+    return response_cache.respond(response_cache.record(item_id, version, item), accept_encoding, version_headers(version))
 
 @app.post("/inventory")
-def create_item(item: InventoryItem):
-    new_item = item.dict()
-    new_item["id"] = max([i["id"] for i in inventory] + [100]) + 1
-    inventory.append(new_item)
-    save_data(inventory)
+def create_item(item: InventoryItem, durable: bool = False):
+    def apply():
+        new_item = inventory.insert(item.dict())
+        pending = persistence.put(new_item)
+        response_cache.invalidate(new_item["id"])
+        notify("upsert", dict(new_item))
+        return new_item, pending
+    new_item, pending = mutations.submit(apply)
+    if durable:
+        pending.wait()
     return new_item
 
 @app.put("/inventory/{item_id}")
-def update_item(item_id: int, updated: InventoryItemUpdate):
-    for i, item in enumerate(inventory):
-        if item["id"] == item_id:
-            updated_data = updated.dict(exclude_unset=True)
-            inventory[i].update(updated_data)
-            save_data(inventory)
-            return inventory[i]
-    raise HTTPException(status_code=404, detail="Item not found")
+def update_item(item_id: int, updated: InventoryItemUpdate, durable: bool = False):
+    def apply():
+        item = inventory.update(item_id, updated.dict(exclude_unset=True))
+        if item is None:
+            raise HTTPException(status_code=404, detail="Item not found")
+        pending = persistence.put(item)
+        response_cache.invalidate(item_id)
+        notify("upsert", dict(item))
+        return item, pending
+    item, pending = mutations.submit(apply)
+    if durable:
+        pending.wait()
+    return item
 
 @app.delete("/inventory/{item_id}")
-def delete_item(item_id: int):
-    for i, item in enumerate(inventory):
-        if item["id"] == item_id:
-            removed = inventory.pop(i)
-            save_data(inventory)
-            return removed
-    raise HTTPException(status_code=404, detail="Item not found")
+def delete_item(item_id: int, durable: bool = False):
+    def apply():
+        removed = inventory.delete(item_id)
+        if removed is None:
+            raise HTTPException(status_code=404, detail="Item not found")
+        pending = persistence.delete(item_id)
+        response_cache.invalidate(item_id)
+        notify("delete", {"id": item_id})
+        return removed, pending
+    removed, pending = mutations.submit(apply)
+    if durable:
+        pending.wait()
+    return removed
+
+# ---------------- Batch ----------------
+class CreateOperation(BaseModel):
+    op: Literal["create"]
+    item: InventoryItem
+
+class UpdateOperation(BaseModel):
+    op: Literal["update"]
+    id: int
+    item: InventoryItemUpdate
+
+class DeleteOperation(BaseModel):
+    op: Literal["delete"]
+    id: int
+
+BatchOperation = Annotated[Union[CreateOperation, UpdateOperation, DeleteOperation], Field(discriminator="op")]
+
+@app.post("/inventory:batch")
+def batch_inventory(operations: List[BatchOperation], durable: bool = False):
+    # The request body is validated as a whole before we get here. Every
+    # operation is then checked against the current state, and the batch is
+    # applied only if all of them can succeed, with a single persistence write
+    # (or, with a shared store, in a single database transaction). It is one
+    # mutation, so readers see either none of it or all of it.
+    def apply():
+        with inventory.transaction():
+            deleted = set()
+            missing = set()
+            for index, operation in enumerate(operations):
+                if operation.op == "create":
+                    continue
+                if operation.id not in inventory or operation.id in deleted:
+                    missing.add(index)
+                elif operation.op == "delete":
+                    deleted.add(operation.id)
+            if missing:
+                results = [
+                    {"index": index, "op": operation.op, "status": 404, "detail": "Item not found"}
+                    if index in missing else
+                    {"index": index, "op": operation.op, "status": 424, "detail": "Not applied"}
+                    for index, operation in enumerate(operations)
+                ]
+                return results, None
+
+            results = []
+            entries = []
+            for index, operation in enumerate(operations):
+                if operation.op == "create":
+                    record = inventory.insert(operation.item.dict())
+                    entries.append({"op": "put", "record": dict(record)})
+                    notify("upsert", dict(record))
+                    results.append({"index": index, "op": "create", "status": 201, "item": dict(record)})
+                elif operation.op == "update":
+                    record = inventory.update(operation.id, operation.item.dict(exclude_unset=True))
+                    entries.append({"op": "put", "record": dict(record)})
+                    notify("upsert", dict(record))
+                    results.append({"index": index, "op": "update", "status": 200, "item": dict(record)})
+                else:
+                    record = inventory.delete(operation.id)
+                    entries.append({"op": "delete", "id": operation.id})
+                    notify("delete", {"id": operation.id})
+                    results.append({"index": index, "op": "delete", "status": 200, "item": record})
+            pending = persistence.commit(entries)
+            for entry in entries:
+                response_cache.invalidate(entry["record"]["id"] if entry["op"] == "put" else entry["id"])
+            return results, pending
+    results, pending = mutations.submit(apply)
+    if pending is None:
+        return JSONResponse({"applied": False, "results": results}, status_code=409)
+    if durable:
+        pending.wait()
+    return JSONResponse({"applied": True, "results": results})
+
+# ---------------- Metrics ----------------
+@app.get("/metrics")
+def get_metrics():
+    return {"persistence": persistence.metrics(), "response_cache": response_cache.metrics(),
+            "change_feed": change_feed.metrics(), "load": load_progress.as_dict(),
+            "search": inventory.text_index.metrics(), "storage": inventory.metrics(),
+            "writer": mutations.metrics()}
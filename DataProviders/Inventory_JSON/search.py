@@ -0,0 +1,181 @@
+from bisect import bisect_left, insort
+from collections import Counter
+from typing import Dict, Iterable, Iterator, List, Set, Tuple
+import heapq
+import re
+
+TOKEN = re.compile(r"\w+")
+
+EXACT_WEIGHT = 3.0
+PREFIX_WEIGHT = 2.0
+TRIGRAM_WEIGHT = 1.0
+MIN_SIMILARITY = 0.3
+
+
+def tokenize(text) -> List[str]:
+    if not isinstance(text, str):
+        return []
+    return TOKEN.findall(text.casefold())
+
+
+def trigrams(token: str) -> Set[str]:
+    padded = f"  {token} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class SortedTokens:
+    """
+    A sorted set of strings kept in blocks of up to ``2 * BLOCK_SIZE``.
+
+    ``add`` and ``remove`` find the block by bisecting the list of block
+    maxima and edit that block in place, so a change costs O(log n +
+    BLOCK_SIZE) rather than a copy of the whole vocabulary. A block that
+    outgrows the limit is split in two and an empty one is dropped.
+    """
+
+    BLOCK_SIZE = 512
+
+    def __init__(self):
+        self._blocks: List[List[str]] = []
+        self._maxes: List[str] = []
+
+    def __len__(self) -> int:
+        return sum(map(len, self._blocks))
+
+    def add(self, token: str):
+        if not self._maxes:
+            self._blocks.append([token])
+            self._maxes.append(token)
+            return
+        block = min(bisect_left(self._maxes, token), len(self._maxes) - 1)
+        tokens = self._blocks[block]
+        insort(tokens, token)
+        self._maxes[block] = tokens[-1]
+        if len(tokens) > 2 * self.BLOCK_SIZE:
+            half = len(tokens) // 2
+            self._blocks[block:block + 1] = [tokens[:half], tokens[half:]]
+            self._maxes[block:block + 1] = [tokens[half - 1], tokens[-1]]
+
+    def remove(self, token: str):
+        block = bisect_left(self._maxes, token)
+        if block == len(self._maxes):
+            return
+        tokens = self._blocks[block]
+        position = bisect_left(tokens, token)
+        if position < len(tokens) and tokens[position] == token:
+            del tokens[position]
+            if tokens:
+                self._maxes[block] = tokens[-1]
+            else:
+                del self._blocks[block], self._maxes[block]
+
+    def starting_with(self, prefix: str) -> Iterator[str]:
+        """The tokens that start with ``prefix``, in order."""
+        block = bisect_left(self._maxes, prefix)
+        if block == len(self._maxes):
+            return
+        position = bisect_left(self._blocks[block], prefix)
+        for tokens in self._blocks[block:]:
+            for token in tokens[position:]:
+                if not token.startswith(prefix):
+                    return
+                yield token
+            position = 0
+
+
+class TextIndex:
+    """
+    Token search over the text ``fields`` of a collection.
+
+    Three structures are kept in step with every mutation:
+    - an inverted index from each token to the ids of the records that
+      contain it;
+    - the vocabulary of tokens as ``SortedTokens``, so tokens that start
+      with a prefix are one binary search away and adding or dropping a
+      token edits a single block;
+    - a trigram index over the vocabulary, for substrings and misspellings.
+
+    The trigram index covers distinct tokens only, never records, so its
+    size depends on the vocabulary and not on the collection.
+
+    One thread writes the index while others search it. Posting sets are
+    copied before they are walked, and a search that walks the vocabulary
+    runs inside ``MutationQueue.read``, which retries it if a write overlaps.
+
+    ``search`` matches every query term against the vocabulary. A term
+    scores ``EXACT_WEIGHT`` for an identical token, ``PREFIX_WEIGHT`` for a
+    token it begins. Only when no token starts with the term does it fall
+    back to tokens that contain it or share enough trigrams with it, scoring
+    ``TRIGRAM_WEIGHT`` times the similarity. A record must match every term;
+    its score is the sum of the best score per term.
+    """
+
+    def __init__(self, fields: Iterable[str]):
+        self.fields = tuple(fields)
+        self._postings: Dict[str, Set[int]] = {}
+        self._vocabulary = SortedTokens()
+        self._trigrams: Dict[str, Set[str]] = {}
+
+    def tokens(self, record: dict) -> Set[str]:
+        return {token for field in self.fields for token in tokenize(record.get(field))}
+
+    def add(self, record: dict):
+        for token in self.tokens(record):
+            postings = self._postings.get(token)
+            if postings is None:
+                postings = self._postings[token] = set()
+                self._vocabulary.add(token)
+                for trigram in trigrams(token):
+                    self._trigrams.setdefault(trigram, set()).add(token)
+            postings.add(record["id"])
+
+    def remove(self, record: dict):
+        for token in self.tokens(record):
+            postings = self._postings.get(token)
+            if postings is None:
+                continue
+            postings.discard(record["id"])
+            if postings:
+                continue
+            del self._postings[token]
+            self._vocabulary.remove(token)
+            for trigram in trigrams(token):
+                bucket = self._trigrams[trigram]
+                bucket.discard(token)
+                if not bucket:
+                    del self._trigrams[trigram]
+
+    def _matches(self, term: str) -> Dict[str, float]:
+        """Vocabulary tokens matching ``term``, with their score."""
+        scores: Dict[str, float] = {}
+        for token in self._vocabulary.starting_with(term):
+            scores[token] = EXACT_WEIGHT if token == term else PREFIX_WEIGHT
+        if not scores and len(term) >= 3:
+            wanted = trigrams(term)
+            shared = Counter(token for trigram in wanted for token in list(self._trigrams.get(trigram, ())))
+            for token, count in shared.items():
+                similarity = count / len(wanted | trigrams(token))
+                if similarity >= MIN_SIMILARITY or term in token:
+                    scores[token] = TRIGRAM_WEIGHT * max(similarity, MIN_SIMILARITY)
+        return scores
+
+    def search(self, query: str, limit: int) -> List[Tuple[int, float]]:
+        """Return up to ``limit`` ``(id, score)`` pairs, best first, ties by id."""
+        totals: Dict[int, float] = {}
+        for number, term in enumerate(dict.fromkeys(tokenize(query))):
+            best: Dict[int, float] = {}
+            for token, score in self._matches(term).items():
+                for record_id in list(self._postings.get(token, ())):
+                    if score > best.get(record_id, 0.0):
+                        best[record_id] = score
+            if number == 0:
+                totals = best
+            else:
+                totals = {record_id: total + best[record_id] for record_id, total in totals.items() if record_id in best}
+            if not totals:
+                return []
+        return heapq.nsmallest(limit, totals.items(), key=lambda item: (-item[1], item[0]))
+
+    def metrics(self) -> dict:
+        return {"tokens": len(self._postings), "trigrams": len(self._trigrams),
+                "postings": sum(len(ids) for ids in self._postings.values())}
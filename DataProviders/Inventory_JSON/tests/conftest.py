@@ -0,0 +1,43 @@
+import importlib
+import os
+import shutil
+import sys
+
+import pytest
+from fastapi.testclient import TestClient
+
+SERVICE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MODULES = ("main", "cache", "columnar", "export", "feed", "persistence", "search", "sqlite_store", "store", "writer")
+
+
+@pytest.fixture
+def start(tmp_path, monkeypatch):
+    """
+    Start the service against a copy of data/ with the given environment,
+    e.g. ``main, client = start(INVENTORY_STORAGE="columnar")``. Calling it
+    again restarts the service on the same files, as after a shutdown.
+    """
+    shutil.copytree(os.path.join(SERVICE_DIR, "data"), tmp_path / "data")
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.syspath_prepend(SERVICE_DIR)
+    clients = []
+
+    def start_service(**env):
+        while clients:
+            clients.pop().__exit__(None, None, None)
+        for name, value in env.items():
+            monkeypatch.setenv(name, value)
+        for name in MODULES:
+            sys.modules.pop(name, None)
+        main = importlib.import_module("main")
+        assert main.load_progress.wait(10), main.load_progress.as_dict()
+        client = TestClient(main.app)
+        client.__enter__()
+        clients.append(client)
+        return main, client
+
+    yield start_service
+    while clients:
+        clients.pop().__exit__(None, None, None)
+    for name in MODULES:
+        sys.modules.pop(name, None)
@@ -0,0 +1,75 @@
+import pytest
+
+ENGINES = ["dict", "columnar", "sqlite"]
+ITEM = {"name": "Desk Lamp", "category": "Furniture", "quantity": 4, "price": 24.5}
+
+
+@pytest.mark.parametrize("engine", ENGINES)
+def test_crud_and_conditional_get(start, engine):
+    main, client = start(INVENTORY_STORAGE=engine)
+    created = client.post("/inventory", json=ITEM).json()
+    assert created == {"id": 104, **ITEM}
+    response = client.get("/inventory/104")
+    assert response.json() == created
+    etag = response.headers["ETag"]
+    assert client.get("/inventory/104", headers={"If-None-Match": etag}).status_code == 304
+    listing = client.get("/inventory")
+    assert client.get("/inventory", headers={"If-None-Match": listing.headers["ETag"]}).status_code == 304
+
+    client.put("/inventory/104", json={"quantity": 9})
+    assert client.get("/inventory/104", headers={"If-None-Match": etag}).json()["quantity"] == 9
+    assert client.get("/inventory", headers={"If-None-Match": listing.headers["ETag"]}).status_code == 200
+    assert client.delete("/inventory/104").status_code == 200
+    assert client.get("/inventory/104").status_code == 404
+
+
+@pytest.mark.parametrize("engine", ENGINES)
+def test_cursor_pagination_walks_the_collection(start, engine):
+    main, client = start(INVENTORY_STORAGE=engine)
+    for number in range(7):
+        client.post("/inventory", json={**ITEM, "name": f"Lamp {number}"})
+    seen, cursor = [], None
+    while True:
+        params = {"limit": 3, "fields": "id,name"}
+        if cursor is not None:
+            params["cursor"] = cursor
+        response = client.get("/inventory", params=params)
+        page = response.json()
+        assert all(set(item) == {"id", "name"} for item in page)
+        seen += [item["id"] for item in page]
+        cursor = response.headers.get("X-Next-Cursor")
+        if cursor is None:
+            break
+    assert seen == list(range(101, 111))
+
+
+@pytest.mark.parametrize("engine", ENGINES)
+def test_multi_get_keeps_the_requested_order(start, engine):
+    main, client = start(INVENTORY_STORAGE=engine)
+    body = client.get("/inventory", params={"ids": "103,999,101", "fields": "id"}).json()
+    assert body == {"inventory": [{"id": 103}, {"id": 101}], "missing": [999]}
+    assert client.get("/inventory", params={"ids": "101", "limit": 5}).status_code == 400
+
+
+@pytest.mark.parametrize("engine", ENGINES)
+def test_batch_with_a_missing_id_applies_nothing(start, engine):
+    main, client = start(INVENTORY_STORAGE=engine)
+    before = client.get("/inventory")
+    response = client.post("/inventory:batch", json=[
+        {"op": "create", "item": ITEM},
+        {"op": "delete", "id": 102},
+        {"op": "update", "id": 102, "item": {"quantity": 1}},
+    ])
+    assert response.status_code == 409
+    assert [result["status"] for result in response.json()["results"]] == [424, 424, 404]
+    after = client.get("/inventory")
+    assert after.json() == before.json()
+    assert after.headers["ETag"] == before.headers["ETag"]
+
+    response = client.post("/inventory:batch", json=[
+        {"op": "create", "item": ITEM},
+        {"op": "delete", "id": 102},
+        {"op": "update", "id": 101, "item": {"quantity": 1}},
+    ])
+    assert response.status_code == 200
+    assert [item["id"] for item in client.get("/inventory").json()] == [101, 103, 104]
@@ -0,0 +1,96 @@
+import threading
+
+import pytest
+
+BATCH_SIZE = 3000
+
+
+@pytest.mark.parametrize("engine", ["dict", "columnar"])
+def test_reads_see_all_or_none_of_a_batch(start, engine):
+    main, client = start(INVENTORY_STORAGE=engine, INVENTORY_PERSISTENCE="journal")
+    before = client.get("/inventory")
+    operations = [{"op": "create", "item": {"name": f"Item {i}", "category": "Bulk", "quantity": i, "price": 1.0}}
+                  for i in range(BATCH_SIZE)]
+    done = threading.Event()
+    seen = []
+
+    def read():
+        while not done.is_set():
+            response = client.get("/inventory")
+            seen.append((response.headers["ETag"], len(response.json())))
+            _, records = main.mutations.read(lambda snapshot: main.inventory.all())
+            seen.append((None, len(records)))
+
+    readers = [threading.Thread(target=read) for _ in range(2)]
+    for reader in readers:
+        reader.start()
+    try:
+        assert client.post("/inventory:batch", json=operations).status_code == 200
+    finally:
+        done.set()
+        for reader in readers:
+            reader.join()
+    after = client.get("/inventory")
+    states = {before.headers["ETag"]: len(before.json()), after.headers["ETag"]: len(after.json())}
+    assert set(states.values()) == {3, 3 + BATCH_SIZE}
+    for etag, count in seen:
+        assert count in states.values()
+        if etag is not None:
+            assert states[etag] == count
+
+
+def test_record_etag_matches_its_body(start):
+    _, client = start()
+    response = client.get("/inventory/101")
+    etag = response.headers["ETag"]
+    assert client.get("/inventory/101", headers={"If-None-Match": etag}).status_code == 304
+    client.put("/inventory/101", json={"quantity": 1})
+    response = client.get("/inventory/101", headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.json()["quantity"] == 1
+    assert response.headers["ETag"] != etag
+
+
+def test_stats_search_and_export_see_all_or_none_of_a_batch(start):
+    main, client = start(INVENTORY_EXPORT_CHUNK_SIZE="10000")
+    operations = [{"op": "create", "item": {"name": f"Bulk {i}", "category": "Bulk", "quantity": 1, "price": 1.0}}
+                  for i in range(BATCH_SIZE)]
+    done = threading.Event()
+    seen = []
+
+    def read():
+        while not done.is_set():
+            seen.append(client.get("/inventory/stats").json()["total"]["items"])
+            seen.append(3 + len(client.get("/inventory/search", params={"q": "bulk", "limit": 1}).json()) * BATCH_SIZE)
+            seen.append(len(client.get("/inventory/export").text.splitlines()))
+
+    reader = threading.Thread(target=read)
+    reader.start()
+    try:
+        assert client.post("/inventory:batch", json=operations).status_code == 200
+    finally:
+        done.set()
+        reader.join()
+    assert set(seen) <= {3, 3 + BATCH_SIZE}
+
+
+def test_conditional_get_validates_parameters_first(start):
+    _, client = start()
+    etag = client.get("/inventory").headers["ETag"]
+    assert client.get("/inventory", headers={"If-None-Match": etag}).status_code == 304
+    for params in ({"fields": "nope"}, {"order_by": "name"}, {"ids": "x"}, {"ids": "101", "limit": 1},
+                   {"order_by": "-price", "cursor": 1}):
+        assert client.get("/inventory", params=params, headers={"If-None-Match": etag}).status_code == 400
+
+
+def test_etag_is_weak_and_varies_with_encoding(start):
+    _, client = start(INVENTORY_RESPONSE_CACHE_GZIP="true")
+    for _ in range(20):
+        client.post("/inventory", json={"name": "Padding " * 10, "category": "Bulk", "quantity": 1, "price": 1.0})
+    plain = client.get("/inventory", headers={"Accept-Encoding": "identity"})
+    gzipped = client.get("/inventory", headers={"Accept-Encoding": "gzip"})
+    assert gzipped.headers["Content-Encoding"] == "gzip"
+    assert "Content-Encoding" not in plain.headers
+    for response in (plain, gzipped, client.get("/inventory/101")):
+        assert response.headers["ETag"].startswith('W/"')
+        assert response.headers["Vary"] == "Accept-Encoding"
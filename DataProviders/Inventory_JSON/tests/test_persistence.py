@@ -0,0 +1,73 @@
+import json
+
+import pytest
+
+from persistence import read_snapshot
+
+STREAMED, WHOLE = 0, 1 << 20
+
+
+@pytest.mark.parametrize("whole_file_limit", [STREAMED, WHOLE])
+@pytest.mark.parametrize("text", ["[,1]", "[1,,2]", "[1,]", "[1 2]", "[1]]", "[1] x", "[1", "{}", "[{\"id\": 1]"])
+def test_malformed_arrays_are_rejected(tmp_path, text, whole_file_limit):
+    data_file = tmp_path / "data.json"
+    data_file.write_text(text)
+    with pytest.raises(ValueError):
+        list(read_snapshot(str(data_file), whole_file_limit=whole_file_limit))
+
+
+@pytest.mark.parametrize("whole_file_limit", [STREAMED, WHOLE])
+@pytest.mark.parametrize("text, expected", [
+    ("", []), ("[]", []), (" [ ] \n", []), ("[1, 22,333]", [1, 22, 333]),
+    ('[{"id": 1, "name": "a, b"},\n {"id": 2}]\n', [{"id": 1, "name": "a, b"}, {"id": 2}]),
+])
+def test_well_formed_arrays_are_read(tmp_path, text, expected, whole_file_limit):
+    data_file = tmp_path / "data.json"
+    data_file.write_text(text)
+    assert list(read_snapshot(str(data_file), chunk_size=3, whole_file_limit=whole_file_limit)) == expected
+
+
+def journal_lines(*entries):
+    return "".join(json.dumps(entry) + "\n" for entry in entries)
+
+
+def test_journal_is_replayed_up_to_a_torn_line(start, tmp_path):
+    journal = tmp_path / "data" / "inventory.journal"
+    intact = journal_lines({"op": "put", "record": {"id": 101, "name": "Laptop", "category": "Electronics", "quantity": 7, "price": 999.99}},
+                           {"op": "delete", "id": 102},
+                           {"op": "put", "record": {"id": 150, "name": "Pen", "category": "Stationery", "quantity": 1, "price": 0.5}})
+    journal.write_text(intact + '{"op": "delete", "id": 1')
+    main, client = start(INVENTORY_PERSISTENCE="journal", INVENTORY_COMPACT_INTERVAL="3600")
+    items = client.get("/inventory").json()
+    assert [(item["id"], item["quantity"]) for item in items] == [(101, 7), (103, 200), (150, 1)]
+    assert journal.read_text() == intact
+    assert client.post("/inventory", json={"name": "Ink", "category": "Stationery", "quantity": 3, "price": 4.0}).json()["id"] == 151
+    assert journal.read_text().startswith(intact) and journal.read_text().count("\n") == 4
+
+
+def test_compaction_folds_the_journal_into_the_data_file(start, tmp_path):
+    data_file, journal = tmp_path / "data" / "inventory.json", tmp_path / "data" / "inventory.journal"
+    main, client = start(INVENTORY_PERSISTENCE="journal", INVENTORY_COMPACT_INTERVAL="3600")
+    client.put("/inventory/101", json={"quantity": 5})
+    client.delete("/inventory/103")
+    assert journal.read_text().count("\n") == 2
+    assert 103 in [record["id"] for record in json.loads(data_file.read_text())]
+
+    main.persistence.compact()
+    assert journal.read_text() == ""
+    assert not (tmp_path / "data" / "inventory.journal.old").exists()
+    assert [(record["id"], record["quantity"]) for record in json.loads(data_file.read_text())] == [(101, 5), (102, 30)]
+
+    client.put("/inventory/102", json={"quantity": 6})
+    main, client = start(INVENTORY_PERSISTENCE="journal", INVENTORY_COMPACT_INTERVAL="3600")
+    assert [(item["id"], item["quantity"]) for item in client.get("/inventory").json()] == [(101, 5), (102, 6)]
+
+
+def test_an_interrupted_compaction_is_finished_at_startup(start, tmp_path):
+    data_file = tmp_path / "data" / "inventory.json"
+    old_journal = tmp_path / "data" / "inventory.journal.old"
+    old_journal.write_text(journal_lines({"op": "delete", "id": 101}))
+    main, client = start(INVENTORY_PERSISTENCE="journal", INVENTORY_COMPACT_INTERVAL="3600")
+    assert not old_journal.exists()
+    assert [record["id"] for record in json.loads(data_file.read_text())] == [102, 103]
+    assert [item["id"] for item in client.get("/inventory").json()] == [102, 103]
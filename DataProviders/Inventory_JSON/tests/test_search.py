@@ -0,0 +1,32 @@
+import random
+
+from search import SortedTokens
+
+
+def test_sorted_tokens_match_a_sorted_set(monkeypatch):
+    monkeypatch.setattr(SortedTokens, "BLOCK_SIZE", 3)
+    rng = random.Random(14)
+    tokens, expected = SortedTokens(), set()
+    for _ in range(2000):
+        token = "".join(rng.choice("abc") for _ in range(rng.randint(1, 4)))
+        if rng.random() < 0.6:
+            if token not in expected:
+                tokens.add(token)
+                expected.add(token)
+        else:
+            tokens.remove(token)
+            expected.discard(token)
+        prefix = "".join(rng.choice("abc") for _ in range(rng.randint(0, 2)))
+        assert list(tokens.starting_with(prefix)) == sorted(token for token in expected if token.startswith(prefix))
+    assert len(tokens) == len(expected)
+
+
+def test_search_follows_renames_and_deletes(start):
+    main, client = start()
+    created = client.post("/inventory", json={"name": "Walnut Shelf", "category": "Furniture", "quantity": 2, "price": 80.0}).json()
+    assert [item["id"] for item in client.get("/inventory/search", params={"q": "waln"}).json()] == [created["id"]]
+    client.put(f"/inventory/{created['id']}", json={"name": "Oak Shelf"})
+    assert client.get("/inventory/search", params={"q": "waln"}).json() == []
+    assert [item["id"] for item in client.get("/inventory/search", params={"q": "oak sh"}).json()] == [created["id"]]
+    client.delete(f"/inventory/{created['id']}")
+    assert client.get("/inventory/search", params={"q": "oak"}).json() == []
@@ -0,0 +1,49 @@
+import random
+
+from store import SortedIndex
+
+
+def test_sorted_index_matches_a_sorted_list(monkeypatch):
+    monkeypatch.setattr(SortedIndex, "BLOCK_SIZE", 4)
+    rng = random.Random(6)
+    index = SortedIndex()
+    index.rebuild((rng.randint(0, 20), record_id) for record_id in range(30))
+    expected = set(index_pairs(index))
+    next_id = 100
+    for _ in range(2000):
+        if rng.random() < 0.5 or not expected:
+            value = rng.randint(0, 20)
+            index.add(value, next_id)
+            expected.add((value, next_id))
+            next_id += 1
+        else:
+            value, record_id = rng.choice(sorted(expected))
+            index.remove(value, record_id)
+            expected.discard((value, record_id))
+        low, high = rng.choice([None, rng.uniform(-1, 21)]), rng.choice([None, rng.uniform(-1, 21)])
+        pairs = sorted(expected)
+        matching = [pair for pair in pairs if (low is None or pair[0] >= low) and (high is None or pair[0] <= high)]
+        assert list(index.ids(low, high)) == [record_id for _, record_id in matching]
+        assert list(index.ids(low, high, descending=True)) == [record_id for _, record_id in reversed(matching)]
+        start, stop = index.span(low, high)
+        assert stop - start == len(matching)
+        assert not matching or pairs[start] == matching[0]
+    assert all(0 < len(block) <= 8 for block in index._ids)
+
+
+def index_pairs(index):
+    return [(value, record_id) for values, ids in zip(index._values, index._ids) for value, record_id in zip(values, ids)]
+
+
+def test_range_query_and_order_follow_updates(start):
+    main, client = start()
+    client.put("/inventory/101", json={"quantity": 500})
+    client.delete("/inventory/102")
+    created = client.post("/inventory", json={"name": "Cable", "category": "Electronics", "quantity": 0, "price": 3.5}).json()
+    items = client.get("/inventory", params={"order_by": "-quantity"}).json()
+    assert [item["id"] for item in items][0] == 101
+    assert [item["id"] for item in items][-1] == created["id"]
+    quantities = [item["quantity"] for item in items]
+    assert quantities == sorted(quantities, reverse=True)
+    low = client.get("/inventory", params={"max_quantity": 0}).json()
+    assert [item["id"] for item in low] == [created["id"]]
@@ -0,0 +1,100 @@
+import threading
+import time
+
+import pytest
+
+from store import StoreSnapshot
+from writer import MutationQueue
+
+
+class Counter:
+    """A minimal store: one number, published as the snapshot version."""
+
+    def __init__(self):
+        self.value = 0
+
+    def snapshot(self) -> StoreSnapshot:
+        return StoreSnapshot(self.value, 0, {})
+
+
+@pytest.fixture
+def queue():
+    mutations = MutationQueue(Counter(), max_group=8)
+    mutations.start()
+    yield mutations
+    mutations.close()
+
+
+def test_mutations_apply_in_order_and_publish_a_snapshot(queue):
+    applied = []
+
+    def increment(number):
+        applied.append(number)
+        queue.store.value += 1
+        return queue.store.value
+
+    results = [None] * 50
+    threads = [threading.Thread(target=lambda n=n: results.__setitem__(n, queue.submit(lambda: increment(n)))) for n in range(50)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert sorted(results) == list(range(1, 51))
+    assert [results[n] for n in applied] == list(range(1, 51))
+    assert queue.snapshot.version == 50
+    metrics = queue.metrics()
+    assert metrics["mutations"] == 50 and metrics["max_group_size"] <= 8
+
+
+def test_a_failing_mutation_raises_in_its_submitter_only(queue):
+    def fail():
+        raise KeyError("missing")
+
+    with pytest.raises(KeyError):
+        queue.submit(fail)
+    assert queue.submit(lambda: "next") == "next"
+
+
+def test_a_read_that_keeps_overlapping_writes_runs_between_mutations(queue):
+    readers = []
+
+    def read(snapshot):
+        readers.append(threading.current_thread())
+        if threading.current_thread() is not queue._writer:
+            # Pretend a writer group ran while this read was in progress.
+            with queue._cond:
+                queue._sequence += 2
+        return snapshot.version
+
+    queue.submit(lambda: setattr(queue.store, "value", 7))
+    snapshot, version = queue.read(read)
+    assert snapshot.version == version == 7
+    assert readers[-1] is queue._writer and len(readers) == queue.read_attempts + 1
+    metrics = queue.metrics()
+    assert (metrics["read_retries"], metrics["read_fallbacks"]) == (queue.read_attempts, 1)
+
+
+def test_close_applies_what_is_queued(queue):
+    running, gate, done = threading.Event(), threading.Event(), []
+    blocked = threading.Thread(target=queue.submit, args=(lambda: running.set() or gate.wait(),))
+    blocked.start()
+    assert running.wait(5)
+    threads = [threading.Thread(target=queue.submit, args=(lambda: done.append(1),)) for _ in range(5)]
+    for thread in threads:
+        thread.start()
+    wait_for(lambda: queue.metrics()["queued"] == 5)
+    closer = threading.Thread(target=queue.close)
+    closer.start()
+    gate.set()
+    for thread in [closer, blocked] + threads:
+        thread.join()
+    assert len(done) == 5
+    with pytest.raises(RuntimeError):
+        queue.submit(lambda: None)
+
+
+def wait_for(condition, timeout: float = 5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline
+        time.sleep(0.001)
@@ -0,0 +1,101 @@
+from typing import Dict, Iterable
+
+
+class ItemLocator:
+    """
+    Where each item is stocked across the network: ``item_id`` to
+    ``{warehouse_id: quantity}``, plus the total quantity of every item.
+
+    The mutation handlers report every change to a warehouse or to one of its
+    items, so looking up an item's locations or total never has to scan the
+    warehouses.
+    """
+
+    def __init__(self):
+        self._locations: Dict[int, Dict[str, int]] = {}
+        self._totals: Dict[int, int] = {}
+
+    def put_item(self, warehouse_id: str, item_id: int, quantity: int):
+        """
+        Record the quantity of an item held by a warehouse.
+
+        Args:
+            warehouse_id (str): The warehouse holding the item
+            item_id (int): The item
+            quantity (int): The quantity now held, replacing any earlier one
+        """
+        locations = self._locations.setdefault(item_id, {})
+        previous = locations.get(warehouse_id, 0)
+        locations[warehouse_id] = quantity
+        self._totals[item_id] = self._totals.get(item_id, 0) + quantity - previous
+
+    def remove_item(self, warehouse_id: str, item_id: int):
+        """
+        Record that a warehouse no longer holds an item.
+
+        Args:
+            warehouse_id (str): The warehouse
+            item_id (int): The item
+        """
+        locations = self._locations.get(item_id)
+        if locations is None or warehouse_id not in locations:
+            return
+        self._totals[item_id] -= locations.pop(warehouse_id)
+        if not locations:
+            del self._locations[item_id]
+            del self._totals[item_id]
+
+    def put_warehouse(self, warehouse_id: str, items: Iterable):
+        """
+        Record every item of a warehouse.
+
+        Args:
+            warehouse_id (str): The warehouse
+            items (Iterable): Its inventory items
+        """
+        for item in items:
+            self.put_item(warehouse_id, item.item_id, item.quantity)
+
+    def remove_warehouse(self, warehouse_id: str, items: Iterable):
+        """
+        Forget every item of a warehouse.
+
+        Args:
+            warehouse_id (str): The warehouse
+            items (Iterable): Its inventory items
+        """
+        for item in items:
+            self.remove_item(warehouse_id, item.item_id)
+
+    def __contains__(self, item_id: int) -> bool:
+        return item_id in self._locations
+
+    def locations(self, item_id: int) -> Dict[str, int]:
+        """
+        Args:
+            item_id (int): The item
+
+        Returns:
+            Dict[str, int]: Quantity held by each warehouse stocking the item
+        """
+        return dict(self._locations.get(item_id, {}))
+
+    def warehouse_count(self, item_id: int) -> int:
+        """
+        Args:
+            item_id (int): The item
+
+        Returns:
+            int: Number of warehouses stocking the item
+        """
+        return len(self._locations.get(item_id, ()))
+
+    def total(self, item_id: int) -> int:
+        """
+        Args:
+            item_id (int): The item
+
+        Returns:
+            int: Quantity held across all warehouses
+        """
+        return self._totals.get(item_id, 0)
@@ -1,10 +1,16 @@
-from fastapi import FastAPI, Request, Response, HTTPException
+from fastapi import FastAPI, Header, Request, Response, HTTPException
 from fastapi.responses import PlainTextResponse
-from pydantic import BaseModel, Field
-from typing import List, Optional, Dict
+from pydantic import BaseModel, Field, field_serializer, field_validator
+from typing import List, Optional, Dict, Tuple
 from datetime import date
+import asyncio
+import os
 import yaml
 
+from locator import ItemLocator
+from persistence import open_persistence
+from serialization import FragmentCache, decode, join_list, load, negotiate, render, respond
+
 class InventoryItem(BaseModel):
     item_id: int
     name: str
@@ -14,21 +20,103 @@ class InventoryItem(BaseModel):
     supplier: str
     restock_date: Optional[date] = None
 
+class StockDelta(BaseModel):
+    delta: int  # Signed change to the quantity
+
+class StockAdjustment(StockDelta):
+    warehouse_id: str
+    item_id: int
+
 class Warehouse(BaseModel):
     warehouse_id: str
     name: str
     location: str
     last_updated: date
-    inventory: List[InventoryItem] = []
+    # Keyed by item_id for O(1) lookups; dicts keep insertion order, so the
+    # items still validate from and serialize to an ordered list.
+    inventory: Dict[int, InventoryItem] = {}
+
+    @field_validator("inventory", mode="before")
+    @classmethod
+    def index_inventory(cls, items):
+        if not isinstance(items, (list, tuple)):
+            raise ValueError("inventory must be a list")
+        index = {}
+        for item in items:
+            item = InventoryItem.model_validate(item)
+            if item.item_id in index:
+                raise ValueError(f"Duplicate item_id {item.item_id} in inventory")
+            index[item.item_id] = item
+        return index
+
+    @field_serializer("inventory")
+    def list_inventory(self, inventory: Dict[int, InventoryItem]) -> List[InventoryItem]:
+        return list(inventory.values())
 
 app = FastAPI()
 
 # In-memory warehouse store
 warehouses: Dict[str, Warehouse] = {}
 
+# Quantity of every item in every warehouse, kept in step with the store
+item_locator = ItemLocator()
+
+def store_warehouse(warehouse: Warehouse):
+    # Add or replace a warehouse, keeping item_locator in step.
+    drop_warehouse(warehouse.warehouse_id)
+    warehouses[warehouse.warehouse_id] = warehouse
+    item_locator.put_warehouse(warehouse.warehouse_id, warehouse.inventory.values())
+
+def drop_warehouse(warehouse_id: str):
+    # Remove a warehouse if present, keeping item_locator in step.
+    warehouse = warehouses.pop(warehouse_id, None)
+    if warehouse is not None:
+        item_locator.remove_warehouse(warehouse_id, warehouse.inventory.values())
+
+# Upper bound on the number of ids in one multi-get request
+MAX_IDS = 1000
+
+DATA_FILE = os.path.join("data", "warehouse.yaml")
+JOURNAL_FILE = os.path.join("data", "warehouse.journal")
+
+# "journal" appends every mutation to JOURNAL_FILE and folds the journal into
+# DATA_FILE every COMPACT_INTERVAL seconds; "memory" never writes anything back.
+PERSISTENCE_MODE = os.environ.get("WAREHOUSE_PERSISTENCE", "journal")
+COMPACT_INTERVAL = float(os.environ.get("WAREHOUSE_COMPACT_INTERVAL", "60"))
+persistence = open_persistence(PERSISTENCE_MODE, DATA_FILE, JOURNAL_FILE, COMPACT_INTERVAL)
+
+# Serialized documents per warehouse, reused until the warehouse changes
+serialized = FragmentCache()
+
+def warehouse_element(warehouse_id: str) -> dict:
+    # A warehouse as one element of the GET /warehouses list.
+    return warehouses[warehouse_id].model_dump()
+
+def apply_entry(entry: dict):
+    # Replay one journal entry; see the mutation handlers for what they record.
+    op = entry["op"]
+    if op == "put":
+        store_warehouse(Warehouse(**entry["record"]))
+    elif op == "delete":
+        drop_warehouse(entry["id"])
+    elif entry["id"] in warehouses:
+        warehouse = warehouses[entry["id"]]
+        if op == "put_item":
+            item = InventoryItem(**entry["item"])
+            warehouse.inventory[item.item_id] = item
+            item_locator.put_item(warehouse.warehouse_id, item.item_id, item.quantity)
+        elif op == "delete_item":
+            warehouse.inventory.pop(entry["item_id"], None)
+            item_locator.remove_item(warehouse.warehouse_id, entry["item_id"])
+        warehouse.last_updated = date.fromisoformat(entry["last_updated"])
+
+async def data_file_snapshot() -> bytes:
+    # The whole data file, assembled from the cached fragments of GET /warehouses.
+    return join_list("warehouses", await serialized.elements(list(warehouses), "yaml", warehouse_element), "yaml")
+
 # Load warehouses from YAML file
-with open('data/warehouse.yaml', 'r') as file:
-    data = yaml.safe_load(file)
+with open(DATA_FILE, 'r') as file:
+    data = load(file)
     
     if not isinstance(data, dict) or 'warehouses' not in data or not isinstance(data['warehouses'], list):
         raise ValueError("Invalid warehouse.yaml format. Expected 'warehouses' list at root level.")
@@ -42,37 +130,74 @@ with open('data/warehouse.yaml', 'r') as file:
                 
             # Create and store warehouse object
             warehouse = Warehouse(**warehouse_data)
-            warehouses[warehouse.warehouse_id] = warehouse
+            store_warehouse(warehouse)
         except ValueError as e:
             print(f"Error loading warehouse: {e}")
 
+# Replay the changes made since the data file was last written
+for entry in persistence.load():
+    apply_entry(entry)
+persistence.start()
+
+@app.on_event("startup")
+async def start_compaction():
+    app.state.compaction = asyncio.create_task(persistence.run(data_file_snapshot))
+
+@app.on_event("shutdown")
+async def close_persistence():
+    compaction = getattr(app.state, "compaction", None)
+    if compaction is not None:
+        compaction.cancel()
+    await persistence.close(data_file_snapshot)
+
 @app.get("/warehouses", response_class=PlainTextResponse)
-async def get_warehouses():
+async def get_warehouses(ids: Optional[str] = None, accept: Optional[str] = Header(None)):
     """
-    Retrieve a list of all warehouses in the system.
+    Retrieve a list of all warehouses in the system, or only the requested ones.
+    
+    Args:
+        ids (str, optional): Comma-separated warehouse IDs to look up in one request
+        accept (str, optional): Accept header choosing YAML (default), JSON or MessagePack
     
     Returns:
-        PlainTextResponse: YAML formatted string containing all warehouse information
+        Response: All warehouse information in the negotiated format.
+            With ids, the warehouses found (in the order requested) and a
+            'missing' list of the IDs that do not exist
+    
+    Raises:
+        HTTPException: 400 if more than MAX_IDS ids are requested
     """
-    return yaml.dump({"warehouses": [w.model_dump() for w in warehouses.values()]}, sort_keys=False)
+    format = negotiate(accept)
+    if ids is not None:
+        requested = list(dict.fromkeys(i.strip() for i in ids.split(",") if i.strip()))
+        if len(requested) > MAX_IDS:
+            raise HTTPException(status_code=400, detail=f"At most {MAX_IDS} ids can be requested at once")
+        found = await serialized.elements([i for i in requested if i in warehouses], format, warehouse_element)
+        missing = [i for i in requested if i not in warehouses]
+        return respond(join_list("warehouses", found, format, {"missing": missing}), format)
+    elements = await serialized.elements(list(warehouses), format, warehouse_element)
+    return respond(join_list("warehouses", elements, format), format)
 
 @app.get("/warehouses/{warehouse_id}", response_class=PlainTextResponse)
-async def get_warehouse(warehouse_id: str):
+async def get_warehouse(warehouse_id: str, accept: Optional[str] = Header(None)):
     """
     Retrieve information about a specific warehouse.
     
     Args:
         warehouse_id (str): The unique identifier of the warehouse
+        accept (str, optional): Accept header choosing YAML (default), JSON or MessagePack
     
     Returns:
-        PlainTextResponse: YAML formatted string containing the warehouse information
+        Response: The warehouse information in the negotiated format
     
     Raises:
         HTTPException: 404 if warehouse is not found
     """
+    format = negotiate(accept)
     if warehouse_id not in warehouses:
         raise HTTPException(status_code=404, detail="Warehouse not found")
-    return yaml.dump(warehouses[warehouse_id].model_dump(), sort_keys=False)
+    return respond(await serialized.document(warehouse_id, "document", format,
+                                             lambda: warehouses[warehouse_id].model_dump()), format)
 
 @app.post("/warehouses", response_class=PlainTextResponse)
 async def add_warehouse(request: Request):
@@ -80,24 +205,27 @@ async def add_warehouse(request: Request):
     Create a new warehouse in the system.
     
     Args:
-        request (Request): FastAPI request object containing YAML formatted warehouse data
+        request (Request): FastAPI request object with warehouse data in the format named by its Content-Type
     
     Returns:
-        PlainTextResponse: YAML formatted string confirming warehouse creation
+        Response: Confirmation of warehouse creation in the negotiated format
     
     Raises:
-        HTTPException: 400 if YAML is invalid or warehouse ID already exists
+        HTTPException: 400 if the body is invalid or warehouse ID already exists
     """
+    format = negotiate(request.headers.get("accept"))
     body = await request.body()
     try:
-        data = yaml.safe_load(body)
+        data = decode(body, request.headers.get("content-type"))
         if data is None:
             raise HTTPException(status_code=400, detail="body must not be empty")
         warehouse = Warehouse(**data)
         if warehouse.warehouse_id in warehouses:
             raise HTTPException(status_code=400, detail="Warehouse ID already exists")
-        warehouses[warehouse.warehouse_id] = warehouse
-        return yaml.dump({"message": "Warehouse added", "warehouse": warehouse.model_dump()}, sort_keys=False)
+        store_warehouse(warehouse)
+        serialized.invalidate(warehouse.warehouse_id)
+        await persistence.commit([{"op": "put", "record": warehouse.model_dump()}])
+        return render({"message": "Warehouse added", "warehouse": warehouse.model_dump()}, format)
     except yaml.YAMLError:
         raise HTTPException(status_code=400, detail="Invalid YAML format")
     except ValueError as e:
@@ -110,67 +238,77 @@ async def update_warehouse(warehouse_id: str, request: Request):
     
     Args:
         warehouse_id (str): The unique identifier of the warehouse to update
-        request (Request): FastAPI request object containing YAML formatted warehouse data
+        request (Request): FastAPI request object with warehouse data in the format named by its Content-Type
     
     Returns:
-        PlainTextResponse: YAML formatted string confirming warehouse update
+        Response: Confirmation of warehouse update in the negotiated format
     
     Raises:
-        HTTPException: 404 if warehouse not found, 400 if YAML is invalid or IDs don't match
+        HTTPException: 404 if warehouse not found, 400 if the body is invalid or IDs don't match
     """
-    if warehouse_id not in warehouses:
-        raise HTTPException(status_code=404, detail="Warehouse not found")
-    
+    format = negotiate(request.headers.get("accept"))
     body = await request.body()
     try:
-        data = yaml.safe_load(body)
+        data = decode(body, request.headers.get("content-type"))
         updated_warehouse = Warehouse(**data)
         if updated_warehouse.warehouse_id != warehouse_id:
             raise HTTPException(status_code=400, detail="Warehouse ID in URL does not match payload")
-        warehouses[warehouse_id] = updated_warehouse
-        return yaml.dump({"message": "Warehouse updated", "warehouse": updated_warehouse.model_dump()}, sort_keys=False)
+        if warehouse_id not in warehouses:
+            raise HTTPException(status_code=404, detail="Warehouse not found")
+        store_warehouse(updated_warehouse)
+        serialized.invalidate(warehouse_id)
+        await persistence.commit([{"op": "put", "record": updated_warehouse.model_dump()}])
+        return render({"message": "Warehouse updated", "warehouse": updated_warehouse.model_dump()}, format)
     except yaml.YAMLError:
         raise HTTPException(status_code=400, detail="Invalid YAML format")
     except ValueError as e:
         raise HTTPException(status_code=400, detail=str(e))
 
 @app.delete("/warehouses/{warehouse_id}", response_class=PlainTextResponse)
-async def delete_warehouse(warehouse_id: str):
+async def delete_warehouse(warehouse_id: str, accept: Optional[str] = Header(None)):
     """
     Delete a warehouse from the system.
     
     Args:
         warehouse_id (str): The unique identifier of the warehouse to delete
+        accept (str, optional): Accept header choosing YAML (default), JSON or MessagePack
     
     Returns:
-        PlainTextResponse: YAML formatted string confirming warehouse deletion
+        Response: Confirmation of warehouse deletion in the negotiated format
     
     Raises:
         HTTPException: 404 if warehouse not found
     """
+    format = negotiate(accept)
     if warehouse_id not in warehouses:
         raise HTTPException(status_code=404, detail="Warehouse not found")
-    del warehouses[warehouse_id]
-    return yaml.dump({"message": f"Warehouse {warehouse_id} deleted"}, sort_keys=False)
+    drop_warehouse(warehouse_id)
+    serialized.invalidate(warehouse_id)
+    await persistence.commit([{"op": "delete", "id": warehouse_id}])
+    return render({"message": f"Warehouse {warehouse_id} deleted"}, format)
 
 # Inventory management within warehouses
 @app.get("/warehouses/{warehouse_id}/inventory", response_class=PlainTextResponse)
-async def get_warehouse_inventory(warehouse_id: str):
+async def get_warehouse_inventory(warehouse_id: str, accept: Optional[str] = Header(None)):
     """
     Retrieve the inventory list for a specific warehouse.
     
     Args:
         warehouse_id (str): The unique identifier of the warehouse
+        accept (str, optional): Accept header choosing YAML (default), JSON or MessagePack
     
     Returns:
-        PlainTextResponse: YAML formatted string containing the warehouse's inventory
+        Response: The warehouse's inventory in the negotiated format
     
     Raises:
         HTTPException: 404 if warehouse not found
     """
+    format = negotiate(accept)
     if warehouse_id not in warehouses:
         raise HTTPException(status_code=404, detail="Warehouse not found")
-    return yaml.dump({"inventory": [item.model_dump() for item in warehouses[warehouse_id].inventory]}, sort_keys=False)
+    return respond(await serialized.document(
+        warehouse_id, "inventory", format,
+        lambda: {"inventory": [item.model_dump() for item in warehouses[warehouse_id].inventory.values()]}), format)
 
 @app.post("/warehouses/{warehouse_id}/inventory", response_class=PlainTextResponse)
 async def add_warehouse_item(warehouse_id: str, request: Request):
@@ -179,30 +317,34 @@ async def add_warehouse_item(warehouse_id: str, request: Request):
     
     Args:
         warehouse_id (str): The unique identifier of the warehouse
-        request (Request): FastAPI request object containing YAML formatted item data
+        request (Request): FastAPI request object with item data in the format named by its Content-Type
     
     Returns:
-        PlainTextResponse: YAML formatted string confirming item addition
+        Response: Confirmation of item addition in the negotiated format
     
     Raises:
-        HTTPException: 404 if warehouse not found, 400 if YAML is invalid or item ID exists
+        HTTPException: 404 if warehouse not found, 400 if the body is invalid or item ID exists
     """
-    if warehouse_id not in warehouses:
-        raise HTTPException(status_code=404, detail="Warehouse not found")
-    
+    format = negotiate(request.headers.get("accept"))
     body = await request.body()
     try:
-        data = yaml.safe_load(body)
+        data = decode(body, request.headers.get("content-type"))
         if data is None:
             raise HTTPException(status_code=400, detail="body must not be empty")
         item = InventoryItem(**data)
+        if warehouse_id not in warehouses:
+            raise HTTPException(status_code=404, detail="Warehouse not found")
         warehouse = warehouses[warehouse_id]
         # Check if item already exists
-        if any(existing.item_id == item.item_id for existing in warehouse.inventory):
+        if item.item_id in warehouse.inventory:
             raise HTTPException(status_code=400, detail="Item ID already exists in this warehouse")
-        warehouse.inventory.append(item)
+        warehouse.inventory[item.item_id] = item
+        item_locator.put_item(warehouse_id, item.item_id, item.quantity)
         warehouse.last_updated = date.today()
-        return yaml.dump({"message": "Item added", "item": item.model_dump()}, sort_keys=False)
+        serialized.invalidate(warehouse_id)
+        await persistence.commit([{"op": "put_item", "id": warehouse_id, "item": item.model_dump(),
+                                   "last_updated": warehouse.last_updated}])
+        return render({"message": "Item added", "item": item.model_dump()}, format)
     except yaml.YAMLError:
         raise HTTPException(status_code=400, detail="Invalid YAML format")
     except ValueError as e:
@@ -216,63 +358,238 @@ async def update_warehouse_item(warehouse_id: str, item_id: int, request: Reques
     Args:
         warehouse_id (str): The unique identifier of the warehouse
         item_id (int): The unique identifier of the item to update
-        request (Request): FastAPI request object containing YAML formatted item data
+        request (Request): FastAPI request object with item data in the format named by its Content-Type
     
     Returns:
-        PlainTextResponse: YAML formatted string confirming item update
+        Response: Confirmation of item update in the negotiated format
     
     Raises:
-        HTTPException: 404 if warehouse or item not found, 400 if YAML is invalid or IDs don't match
+        HTTPException: 404 if warehouse or item not found, 400 if the body is invalid or IDs don't match
     """
-    if warehouse_id not in warehouses:
-        raise HTTPException(status_code=404, detail="Warehouse not found")
-    
-    warehouse = warehouses[warehouse_id]
+    format = negotiate(request.headers.get("accept"))
     body = await request.body()
     try:
-        data = yaml.safe_load(body)
+        data = decode(body, request.headers.get("content-type"))
         updated_item = InventoryItem(**data)
         if updated_item.item_id != item_id:
             raise HTTPException(status_code=400, detail="Item ID in URL does not match payload")
         
-        for i, item in enumerate(warehouse.inventory):
-            if item.item_id == item_id:
-                warehouse.inventory[i] = updated_item
-                warehouse.last_updated = date.today()
-                return yaml.dump({"message": "Item updated", "item": updated_item.model_dump()}, sort_keys=False)
-        raise HTTPException(status_code=404, detail="Item not found in warehouse")
+        # Look the warehouse up only now: a DELETE or PUT may have replaced it
+        # while the body was being read.
+        if warehouse_id not in warehouses:
+            raise HTTPException(status_code=404, detail="Warehouse not found")
+        warehouse = warehouses[warehouse_id]
+        if item_id not in warehouse.inventory:
+            raise HTTPException(status_code=404, detail="Item not found in warehouse")
+        warehouse.inventory[item_id] = updated_item
+        item_locator.put_item(warehouse_id, item_id, updated_item.quantity)
+        warehouse.last_updated = date.today()
+        serialized.invalidate(warehouse_id)
+        await persistence.commit([{"op": "put_item", "id": warehouse_id, "item": updated_item.model_dump(),
+                                   "last_updated": warehouse.last_updated}])
+        return render({"message": "Item updated", "item": updated_item.model_dump()}, format)
     except yaml.YAMLError:
         raise HTTPException(status_code=400, detail="Invalid YAML format")
     except ValueError as e:
         raise HTTPException(status_code=400, detail=str(e))
 
 @app.delete("/warehouses/{warehouse_id}/inventory/{item_id}", response_class=PlainTextResponse)
-async def delete_warehouse_item(warehouse_id: str, item_id: int):
+async def delete_warehouse_item(warehouse_id: str, item_id: int, accept: Optional[str] = Header(None)):
     """
     Delete an inventory item from a specific warehouse.
     
     Args:
         warehouse_id (str): The unique identifier of the warehouse
         item_id (int): The unique identifier of the item to delete
+        accept (str, optional): Accept header choosing YAML (default), JSON or MessagePack
     
     Returns:
-        PlainTextResponse: YAML formatted string confirming item deletion
+        Response: Confirmation of item deletion in the negotiated format
     
     Raises:
         HTTPException: 404 if warehouse or item not found
     """
+    format = negotiate(accept)
     if warehouse_id not in warehouses:
         raise HTTPException(status_code=404, detail="Warehouse not found")
     
     warehouse = warehouses[warehouse_id]
-    original_length = len(warehouse.inventory)
-    warehouse.inventory = [item for item in warehouse.inventory if item.item_id != item_id]
-    
-    if len(warehouse.inventory) == original_length:
+    if warehouse.inventory.pop(item_id, None) is None:
         raise HTTPException(status_code=404, detail="Item not found in warehouse")
+    item_locator.remove_item(warehouse_id, item_id)
     
     warehouse.last_updated = date.today()
-    return yaml.dump({"message": f"Item {item_id} deleted from warehouse {warehouse_id}"}, sort_keys=False)
+    serialized.invalidate(warehouse_id)
+    await persistence.commit([{"op": "delete_item", "id": warehouse_id, "item_id": item_id,
+                               "last_updated": warehouse.last_updated}])
+    return render({"message": f"Item {item_id} deleted from warehouse {warehouse_id}"}, format)
+
+# Stock adjustments
+def adjust_stock(warehouse: Warehouse, item: InventoryItem, delta: int) -> dict:
+    # Apply a delta already checked to keep the quantity non-negative. Only the
+    # quantity changes, so the item is updated in place instead of revalidated.
+    item.quantity += delta
+    warehouse.last_updated = date.today()
+    item_locator.put_item(warehouse.warehouse_id, item.item_id, item.quantity)
+    serialized.invalidate(warehouse.warehouse_id)
+    return {"op": "put_item", "id": warehouse.warehouse_id, "item": item.model_dump(),
+            "last_updated": warehouse.last_updated}
+
+@app.post("/warehouses/{warehouse_id}/inventory/{item_id}/adjust", response_class=PlainTextResponse)
+async def adjust_warehouse_item(warehouse_id: str, item_id: int, request: Request):
+    """
+    Change the quantity of an inventory item by a signed delta.
+    
+    The quantity is checked and changed in one step, so concurrent adjustments
+    of the same item never overwrite each other.
+    
+    Args:
+        warehouse_id (str): The unique identifier of the warehouse
+        item_id (int): The unique identifier of the item to adjust
+        request (Request): FastAPI request object with a 'delta' integer in the format named by its Content-Type
+    
+    Returns:
+        Response: The adjusted item in the negotiated format
+    
+    Raises:
+        HTTPException: 404 if warehouse or item not found, 400 if the body is invalid,
+            409 if the delta would make the quantity negative
+    """
+    format = negotiate(request.headers.get("accept"))
+    body = await request.body()
+    try:
+        data = decode(body, request.headers.get("content-type"))
+        if data is None:
+            raise HTTPException(status_code=400, detail="body must not be empty")
+        adjustment = StockDelta.model_validate(data)
+    except yaml.YAMLError:
+        raise HTTPException(status_code=400, detail="Invalid YAML format")
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if warehouse_id not in warehouses:
+        raise HTTPException(status_code=404, detail="Warehouse not found")
+    warehouse = warehouses[warehouse_id]
+    item = warehouse.inventory.get(item_id)
+    if item is None:
+        raise HTTPException(status_code=404, detail="Item not found in warehouse")
+    if item.quantity + adjustment.delta < 0:
+        raise HTTPException(status_code=409, detail=f"Insufficient stock: {item.quantity} on hand")
+    entry = adjust_stock(warehouse, item, adjustment.delta)
+    await persistence.commit([entry])
+    return render({"message": "Item adjusted", "item": entry["item"]}, format)
+
+@app.post("/inventory:adjust", response_class=PlainTextResponse)
+async def adjust_inventory(request: Request):
+    """
+    Apply many stock adjustments, across any warehouses, all or nothing.
+    
+    Adjustments are applied in order; one that would make a quantity negative
+    (counting the earlier adjustments of the same item) or that targets a missing
+    warehouse or item rejects the whole batch.
+    
+    Args:
+        request (Request): FastAPI request object with a list of adjustments
+            (warehouse_id, item_id, delta) in the format named by its Content-Type
+    
+    Returns:
+        Response: 'applied' and a per-adjustment 'results' list in the negotiated
+            format; 409 with the failing adjustments marked if nothing was applied
+    
+    Raises:
+        HTTPException: 400 if the body is invalid
+    """
+    format = negotiate(request.headers.get("accept"))
+    body = await request.body()
+    try:
+        data = decode(body, request.headers.get("content-type"))
+        if not isinstance(data, list):
+            raise HTTPException(status_code=400, detail="body must be a list of adjustments")
+        adjustments = []
+        for index, adjustment in enumerate(data):
+            try:
+                adjustments.append(StockAdjustment.model_validate(adjustment))
+            except ValueError as e:
+                raise ValueError(f"Invalid adjustment at index {index}: {e}") from None
+    except yaml.YAMLError:
+        raise HTTPException(status_code=400, detail="Invalid YAML format")
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    # Check the whole batch against the current state before changing anything;
+    # nothing below awaits, so no other request can interleave.
+    quantities: Dict[Tuple[str, int], int] = {}
+    failures: Dict[int, dict] = {}
+    for index, adjustment in enumerate(adjustments):
+        warehouse = warehouses.get(adjustment.warehouse_id)
+        item = warehouse.inventory.get(adjustment.item_id) if warehouse is not None else None
+        if warehouse is None:
+            failures[index] = {"status": 404, "detail": "Warehouse not found"}
+            continue
+        if item is None:
+            failures[index] = {"status": 404, "detail": "Item not found in warehouse"}
+            continue
+        key = (adjustment.warehouse_id, adjustment.item_id)
+        on_hand = quantities.get(key, item.quantity)
+        if on_hand + adjustment.delta < 0:
+            failures[index] = {"status": 409, "detail": f"Insufficient stock: {on_hand} on hand"}
+        else:
+            quantities[key] = on_hand + adjustment.delta
+    if failures:
+        results = [{"index": index, "warehouse_id": adjustment.warehouse_id, "item_id": adjustment.item_id,
+                    **failures.get(index, {"status": 424, "detail": "Not applied"})}
+                   for index, adjustment in enumerate(adjustments)]
+        return render({"applied": False, "results": results}, format, status_code=409)
+    results = []
+    entries = {}
+    for index, adjustment in enumerate(adjustments):
+        warehouse = warehouses[adjustment.warehouse_id]
+        item = warehouse.inventory[adjustment.item_id]
+        entries[(adjustment.warehouse_id, adjustment.item_id)] = adjust_stock(warehouse, item, adjustment.delta)
+        results.append({"index": index, "warehouse_id": adjustment.warehouse_id, "item_id": adjustment.item_id,
+                        "status": 200, "quantity": item.quantity})
+    await persistence.commit(list(entries.values()))
+    return render({"applied": True, "results": results}, format)
+
+# Item locations across warehouses
+@app.get("/items/{item_id}/locations", response_class=PlainTextResponse)
+async def get_item_locations(item_id: int, accept: Optional[str] = Header(None)):
+    """
+    Retrieve the quantity of an item held by each warehouse that stocks it.
+    
+    Args:
+        item_id (int): The unique identifier of the item
+        accept (str, optional): Accept header choosing YAML (default), JSON or MessagePack
+    
+    Returns:
+        Response: The item ID and a 'locations' mapping of warehouse ID to quantity
+    
+    Raises:
+        HTTPException: 404 if no warehouse stocks the item
+    """
+    format = negotiate(accept)
+    if item_id not in item_locator:
+        raise HTTPException(status_code=404, detail="Item not found in any warehouse")
+    return render({"item_id": item_id, "locations": item_locator.locations(item_id)}, format)
+
+@app.get("/items/{item_id}/total", response_class=PlainTextResponse)
+async def get_item_total(item_id: int, accept: Optional[str] = Header(None)):
+    """
+    Retrieve the total quantity of an item across all warehouses.
+    
+    Args:
+        item_id (int): The unique identifier of the item
+        accept (str, optional): Accept header choosing YAML (default), JSON or MessagePack
+    
+    Returns:
+        Response: The item ID, its total quantity and the number of warehouses stocking it
+    
+    Raises:
+        HTTPException: 404 if no warehouse stocks the item
+    """
+    format = negotiate(accept)
+    if item_id not in item_locator:
+        raise HTTPException(status_code=404, detail="Item not found in any warehouse")
+    return render({"item_id": item_id, "total_quantity": item_locator.total(item_id),
+                   "warehouses": item_locator.warehouse_count(item_id)}, format)
 
 if __name__ == "__main__":
     # Run with: python main.py  (or use uvicorn directly for production)
@@ -0,0 +1,362 @@
+import asyncio
+from datetime import date
+from typing import Awaitable, Callable, Dict, Hashable, Iterable, List, Optional, Tuple, Union
+import json
+
+import yaml
+from fastapi import HTTPException, Response
+from fastapi.concurrency import run_in_threadpool
+
+# libyaml's C emitter and parser are several times faster than the pure-Python
+# ones; PyYAML builds without libyaml fall back to the latter.
+try:
+    from yaml import CSafeDumper as SafeDumper, CSafeLoader as SafeLoader
+except ImportError:
+    from yaml import SafeDumper, SafeLoader
+
+# MessagePack is optional; without it only YAML and JSON are offered.
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+# Response media type per format. YAML keeps the text/plain type the
+# providers have always answered with.
+MEDIA_TYPES = {
+    "yaml": "text/plain; charset=utf-8",
+    "json": "application/json",
+    "msgpack": "application/msgpack",
+}
+
+# Media types accepted in Accept and Content-Type headers.
+FORMATS_BY_MEDIA_TYPE = {
+    "application/yaml": "yaml",
+    "application/x-yaml": "yaml",
+    "text/yaml": "yaml",
+    "text/x-yaml": "yaml",
+    "text/plain": "yaml",
+    "application/json": "json",
+    "application/msgpack": "msgpack",
+    "application/x-msgpack": "msgpack",
+    "application/vnd.msgpack": "msgpack",
+}
+
+
+def dump(data) -> str:
+    """
+    Serialize data to YAML, keeping the key order of the models.
+
+    Args:
+        data: Plain Python data (dicts, lists, scalars and dates)
+
+    Returns:
+        str: The YAML document
+    """
+    return yaml.dump(data, Dumper=SafeDumper, sort_keys=False)
+
+
+def load(stream):
+    """
+    Parse a YAML document with the safe loader.
+
+    Args:
+        stream: YAML text, bytes or an open file
+
+    Returns:
+        The parsed data
+
+    Raises:
+        yaml.YAMLError: If the document is not valid YAML
+    """
+    return yaml.load(stream, Loader=SafeLoader)
+
+
+def _plain(value):
+    # JSON and MessagePack have no date type; send ISO 8601 strings, which the
+    # models parse back into dates.
+    if isinstance(value, date):
+        return value.isoformat()
+    raise TypeError(f"Cannot serialize {type(value).__name__}")
+
+
+def _media_type(header: str) -> str:
+    return header.split(";", 1)[0].strip().lower()
+
+
+def negotiate(accept: Optional[str]) -> str:
+    """
+    Pick the response format from an Accept header.
+
+    Args:
+        accept (str, optional): The Accept request header
+
+    Returns:
+        str: "yaml", "json" or "msgpack"; "yaml" when the header is missing or
+            names nothing more specific
+
+    Raises:
+        HTTPException: 406 if only MessagePack is acceptable and it is not installed
+    """
+    if not accept:
+        return "yaml"
+    choices = []
+    for position, part in enumerate(accept.split(",")):
+        media_type, _, parameters = part.partition(";")
+        quality = 1.0
+        for parameter in parameters.split(";"):
+            name, _, value = parameter.partition("=")
+            if name.strip() == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        format = FORMATS_BY_MEDIA_TYPE.get(_media_type(media_type))
+        if format is not None and quality > 0:
+            choices.append((-quality, position, format))
+    for _, _, format in sorted(choices):
+        if format != "msgpack" or msgpack is not None:
+            return format
+    if choices:
+        raise HTTPException(status_code=406, detail="MessagePack support is not installed")
+    return "yaml"
+
+
+def encode(data, format: str) -> bytes:
+    """
+    Serialize data in one of the supported formats.
+
+    Args:
+        data: Plain Python data (dicts, lists, scalars and dates)
+        format (str): "yaml", "json" or "msgpack"
+
+    Returns:
+        bytes: The encoded document
+    """
+    if format == "json":
+        return json.dumps(data, default=_plain, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    if format == "msgpack":
+        return msgpack.packb(data, default=_plain, use_bin_type=True)
+    return dump(data).encode("utf-8")
+
+
+def encode_element(data, format: str) -> bytes:
+    """
+    Serialize one element of a list response so that ``join_list`` can
+    splice it in unchanged.
+
+    Args:
+        data: The element
+        format (str): "yaml", "json" or "msgpack"
+
+    Returns:
+        bytes: The encoded element
+    """
+    if format == "yaml":
+        return dump([data]).encode("utf-8")
+    return encode(data, format)
+
+
+def join_list(key: str, elements: List[bytes], format: str, extra: Optional[Dict[str, object]] = None) -> bytes:
+    """
+    Assemble ``{key: [...], **extra}`` from elements encoded by ``encode_element``.
+
+    Args:
+        key (str): The top-level key of the list
+        elements (List[bytes]): The encoded elements, in order
+        format (str): "yaml", "json" or "msgpack"
+        extra (dict, optional): Further top-level keys, encoded after the list
+
+    Returns:
+        bytes: The same document as ``encode({key: [...], **extra}, format)``
+    """
+    extra = extra or {}
+    if format == "json":
+        parts = [b"{", encode(key, format), b":[", b",".join(elements), b"]"]
+        for name, value in extra.items():
+            parts += [b",", encode(name, format), b":", encode(value, format)]
+        parts.append(b"}")
+        return b"".join(parts)
+    if format == "msgpack":
+        packer = msgpack.Packer(default=_plain, use_bin_type=True)
+        parts = [packer.pack_map_header(1 + len(extra)), packer.pack(key), packer.pack_array_header(len(elements))]
+        parts += elements
+        for name, value in extra.items():
+            parts += [packer.pack(name), packer.pack(value)]
+        return b"".join(parts)
+    body = b"".join(elements)
+    head = f"{key}:\n".encode("utf-8") + body if body else f"{key}: []\n".encode("utf-8")
+    return head + (encode(extra, format) if extra else b"")
+
+
+def decode(body: bytes, content_type: Optional[str]):
+    """
+    Parse a request body in the format named by its Content-Type header.
+
+    Args:
+        body (bytes): The raw request body
+        content_type (str, optional): The Content-Type request header; YAML
+            is assumed when it is missing or not a supported type
+
+    Returns:
+        The parsed data
+
+    Raises:
+        yaml.YAMLError: If a YAML body is not valid YAML
+        ValueError: If a JSON or MessagePack body cannot be parsed
+        HTTPException: 415 if the body is MessagePack and it is not installed
+    """
+    format = FORMATS_BY_MEDIA_TYPE.get(_media_type(content_type)) if content_type else None
+    if format == "json":
+        try:
+            return json.loads(body) if body else None
+        except ValueError:
+            raise ValueError("Invalid JSON format") from None
+    if format == "msgpack":
+        if msgpack is None:
+            raise HTTPException(status_code=415, detail="MessagePack support is not installed")
+        try:
+            return msgpack.unpackb(body, raw=False) if body else None
+        except Exception:
+            raise ValueError("Invalid MessagePack format") from None
+    return load(body)
+
+
+def render(data, format: str, status_code: int = 200) -> Response:
+    """
+    Build a response holding data in the negotiated format.
+
+    Args:
+        data: Plain Python data
+        format (str): "yaml", "json" or "msgpack"
+        status_code (int): The HTTP status of the response
+
+    Returns:
+        Response: The encoded response
+    """
+    return respond(encode(data, format), format, status_code)
+
+
+def respond(body: bytes, format: str, status_code: int = 200) -> Response:
+    """
+    Wrap an already encoded body in a response.
+
+    Args:
+        body (bytes): The encoded document
+        format (str): "yaml", "json" or "msgpack"
+        status_code (int): The HTTP status of the response
+
+    Returns:
+        Response: The response, marked as varying with the Accept header
+    """
+    return Response(content=body, status_code=status_code, media_type=MEDIA_TYPES[format],
+                    headers={"Vary": "Accept"})
+
+
+class FragmentCache:
+    """
+    Serialized documents for each resource, built once and reused until the
+    resource changes.
+
+    A resource is cached in several variants: as an element of the
+    collection response, as a document of its own and as its item list,
+    each in every format that has been asked for. The mutation handlers
+    call ``invalidate`` with the resource ID, which drops every variant.
+    Serialization runs on the threadpool so the event loop keeps serving
+    other requests. Requests that miss the same fragment at the same time
+    wait for the one serialization already in flight instead of starting
+    their own.
+    """
+
+    def __init__(self):
+        self._fragments: Dict[Hashable, Dict[Tuple[str, str], bytes]] = {}
+        self._inflight: Dict[Tuple[Hashable, Tuple[str, str]], asyncio.Future] = {}
+        self._generations: Dict[Hashable, int] = {}
+
+    async def document(self, resource_id: Hashable, name: str, format: str,
+                       snapshot: Callable[[], object]) -> bytes:
+        """
+        Return a cached document about one resource, serializing it first if necessary.
+
+        Args:
+            resource_id (Hashable): The ID of the warehouse or order
+            name (str): Which document about the resource is wanted
+            format (str): "yaml", "json" or "msgpack"
+            snapshot (Callable[[], object]): Returns the data to serialize; it
+                is called straight away, before any other request can run
+
+        Returns:
+            bytes: The encoded document
+        """
+        result = self._resolve(resource_id, (name, format), snapshot, lambda data: encode(data, format))
+        return result if isinstance(result, bytes) else await result
+
+    async def elements(self, resource_ids: Iterable[Hashable], format: str,
+                       snapshot: Callable[[Hashable], object]) -> List[bytes]:
+        """
+        Return several resources encoded as list elements, in the order given.
+
+        Args:
+            resource_ids (Iterable[Hashable]): The IDs of the resources
+            format (str): "yaml", "json" or "msgpack"
+            snapshot (Callable[[Hashable], object]): Returns the data to
+                serialize for one resource ID; called for every miss before
+                any other request can run, so all elements show one state
+
+        Returns:
+            List[bytes]: One encoded element per resource ID, for ``join_list``
+        """
+        results = [self._resolve(resource_id, ("element", format),
+                                 lambda resource_id=resource_id: snapshot(resource_id),
+                                 lambda data: encode_element(data, format))
+                   for resource_id in resource_ids]
+        pending = [i for i, result in enumerate(results) if not isinstance(result, bytes)]
+        for i, fragment in zip(pending, await asyncio.gather(*(results[i] for i in pending))):
+            results[i] = fragment
+        return results
+
+    def _resolve(self, resource_id: Hashable, variant: Tuple[str, str], snapshot: Callable[[], object],
+                 encoder: Callable[[object], bytes]) -> Union[bytes, Awaitable[bytes]]:
+        # Runs without yielding to the event loop: the snapshot and the
+        # generation it is checked against are taken at the same moment.
+        fragment = self._fragments.get(resource_id, {}).get(variant)
+        if fragment is not None:
+            return fragment
+        key = (resource_id, variant)
+        inflight = self._inflight.get(key)
+        if inflight is not None:
+            return asyncio.shield(inflight)
+        data = snapshot()
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        return self._build(key, future, encoder, data, self._generations.get(resource_id, 0))
+
+    async def _build(self, key: Tuple[Hashable, Tuple[str, str]], future: asyncio.Future,
+                     encoder: Callable[[object], bytes], data, generation: int) -> bytes:
+        resource_id, variant = key
+        try:
+            fragment = await run_in_threadpool(encoder, data)
+        except BaseException as e:
+            future.set_exception(e)
+            future.exception()  # Mark it retrieved when nobody else is waiting.
+            raise
+        finally:
+            if self._inflight.get(key) is future:
+                del self._inflight[key]
+        # A mutation that landed while serializing makes this fragment stale:
+        # answer the requests that were already waiting, but do not keep it.
+        if self._generations.get(resource_id, 0) == generation:
+            self._fragments.setdefault(resource_id, {})[variant] = fragment
+        future.set_result(fragment)
+        return fragment
+
+    def invalidate(self, resource_id: Hashable):
+        """
+        Drop every cached variant of a resource after it changed.
+
+        Args:
+            resource_id (Hashable): The ID of the resource that changed
+        """
+        self._fragments.pop(resource_id, None)
+        self._generations[resource_id] = self._generations.get(resource_id, 0) + 1
+        for key in [key for key in self._inflight if key[0] == resource_id]:
+            del self._inflight[key]
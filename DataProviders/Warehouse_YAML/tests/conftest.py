@@ -0,0 +1,23 @@
+import importlib
+import os
+import shutil
+import sys
+
+import pytest
+from fastapi.testclient import TestClient
+
+SERVICE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    # main.py reads data/warehouse.yaml relative to the working directory, so
+    # run it against a copy and keep every change in memory.
+    shutil.copytree(os.path.join(SERVICE_DIR, "data"), tmp_path / "data")
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setenv("WAREHOUSE_PERSISTENCE", "memory")
+    monkeypatch.syspath_prepend(SERVICE_DIR)
+    sys.modules.pop("main", None)
+    main = importlib.import_module("main")
+    yield TestClient(main.app)
+    sys.modules.pop("main", None)
@@ -0,0 +1,19 @@
+import pytest
+
+
+@pytest.mark.parametrize("body", ["5", "- delta: 1", "just text"])
+def test_adjust_rejects_non_mapping_body(client, body):
+    response = client.post("/warehouses/WH001/inventory/1002/adjust", content=body)
+    assert response.status_code == 400
+
+
+@pytest.mark.parametrize("body", ["[1, 2]", '[{"warehouse_id": "WH001", "item_id": 1002, "delta": 1}, "x"]'])
+def test_batch_adjust_rejects_non_mapping_entries(client, body):
+    response = client.post("/inventory:adjust", content=body, headers={"Content-Type": "application/json"})
+    assert response.status_code == 400
+    assert "index" in response.json()["detail"]
+
+
+def test_batch_adjust_rejects_non_list_body(client):
+    response = client.post("/inventory:adjust", content="5")
+    assert response.status_code == 400
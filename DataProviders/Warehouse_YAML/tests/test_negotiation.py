@@ -0,0 +1,47 @@
+import json
+
+import pytest
+import yaml
+
+msgpack = pytest.importorskip("msgpack")
+
+
+def test_formats_carry_the_same_data(client):
+    as_yaml = client.get("/warehouses/WH001")
+    as_json = client.get("/warehouses/WH001", headers={"Accept": "application/json"})
+    as_msgpack = client.get("/warehouses/WH001", headers={"Accept": "application/msgpack"})
+    assert as_yaml.headers["content-type"].startswith("text/plain")
+    assert as_json.headers["content-type"] == "application/json"
+    assert as_msgpack.headers["content-type"] == "application/msgpack"
+    document = json.loads(as_json.content)
+    assert msgpack.unpackb(as_msgpack.content) == document
+    assert json.loads(json.dumps(yaml.safe_load(as_yaml.text), default=str)) == document
+
+
+@pytest.mark.parametrize("accept, media_type", [
+    ("application/json;q=0.5, application/msgpack", "application/msgpack"),
+    ("application/msgpack;q=0.2, application/json;q=0.9", "application/json"),
+    ("application/json;q=0, text/yaml", "text/plain; charset=utf-8"),
+    ("text/html", "text/plain; charset=utf-8"),
+])
+def test_accept_quality_picks_the_format(client, accept, media_type):
+    response = client.get("/warehouses", headers={"Accept": accept})
+    assert response.status_code == 200
+    assert response.headers["content-type"] == media_type
+
+
+def test_multi_get_in_json(client):
+    response = client.get("/warehouses", params={"ids": "WH001,NOPE"}, headers={"Accept": "application/json"})
+    body = response.json()
+    assert [warehouse["warehouse_id"] for warehouse in body["warehouses"]] == ["WH001"]
+    assert body["missing"] == ["NOPE"]
+
+
+def test_json_body_is_accepted(client):
+    warehouse = {"warehouse_id": "WH900", "name": "Test", "location": "Nowhere", "last_updated": "2025-09-01", "inventory": []}
+    response = client.post("/warehouses", content=json.dumps(warehouse),
+                           headers={"Content-Type": "application/json", "Accept": "application/json"})
+    assert response.status_code == 200, response.text
+    assert response.json()["warehouse"]["warehouse_id"] == "WH900"
+    created = client.get("/warehouses/WH900", headers={"Accept": "application/json"}).json()
+    assert created["last_updated"] == "2025-09-01"